@@ -0,0 +1,156 @@
+# Item analysis of a SCORM package's attempts: how hard each question and part was, how well it separated stronger students from weaker ones, and how consistent the test is as a whole.
+# Everything is worked out from the columns of the package's AttemptStore, with one matrix of scores for the questions and one for the parts.
+
+from collections import defaultdict,namedtuple
+
+import numpy as np
+
+from blackboardscorm import parse_interaction_id
+
+# how many of the most common responses to each part are listed
+num_responses = 10
+
+QuestionStatistics = namedtuple('QuestionStatistics',('question','name','count','max_score','mean','facility','discrimination','distribution'))
+PartStatistics = namedtuple('PartStatistics',('id','question','name','count','max_score','mean','facility','discrimination','distribution','responses','other_responses'))
+ResponseFrequency = namedtuple('ResponseFrequency',('response','count','proportion','mean_score'))
+
+def to_float(value):
+	try:
+		return float(value)
+	except (TypeError,ValueError):
+		return np.nan
+
+def to_number(value):
+	value = float(value)
+	return None if np.isnan(value) else value
+
+# The mean of each column, which is 0 when there are no rows.
+def means(scores):
+	return scores.sum(axis=0)/max(len(scores),1)
+
+# The correlation between each column of scores and the rest of the total score, leaving that column out.
+# For an item scored right or wrong, this is the point-biserial correlation with the rest of the test. It's nan where either doesn't vary.
+def item_rest_correlations(scores,totals):
+	rest = totals[:,None]-scores
+	scores = scores-means(scores)
+	rest = rest-means(rest)
+	with np.errstate(invalid='ignore',divide='ignore'):
+		return (scores*rest).sum(axis=0)/np.sqrt((scores**2).sum(axis=0)*(rest**2).sum(axis=0))
+
+def cronbach_alpha(scores):
+	num_items = scores.shape[1]
+	if num_items<2 or scores.shape[0]<2:
+		return None
+	total_variance = scores.sum(axis=1).var(ddof=1)
+	if total_variance==0:
+		return None
+	return float(num_items/(num_items-1)*(1-scores.var(axis=0,ddof=1).sum()/total_variance))
+
+def distribution(scores):
+	values,counts = np.unique(scores,return_counts=True)
+	return [(float(value),int(count)) for value,count in zip(values,counts)]
+
+# Fill a matrix with one row per attempt and one column per item from rows of a table, given by a matrix of row numbers with -1 where an attempt doesn't have that item.
+def gather(values,rows):
+	return np.where(rows>=0,values[np.maximum(rows,0)],np.nan)
+
+# Every attempt counts, and an attempt which doesn't include a question or part counts as scoring nothing on it.
+class ItemAnalysis(object):
+	def __init__(self,scorm):
+		store = scorm.store
+		self.num_attempts = len(store)
+
+		questions = scorm.objective_ids
+		objective_rows = store.objective_rows(questions)
+		present = objective_rows>=0
+		scores = np.nan_to_num(gather(store.objectives.raw_score,objective_rows))
+		max_scores = np.fmax.reduce(gather(store.objectives.max_score,objective_rows),axis=0,initial=0)
+		totals = scores.sum(axis=1)
+		self.alpha = cronbach_alpha(scores)
+
+		found,first_rows = np.unique(store.objectives.question,return_index=True)
+		names = {int(question):store.objectives.name[row] for question,row in zip(found,first_rows)}
+
+		question_means = means(scores)
+		with np.errstate(invalid='ignore',divide='ignore'):
+			facilities = question_means/max_scores
+		discriminations = item_rest_correlations(scores,totals)
+		self.questions = [
+			QuestionStatistics(
+				question = question,
+				name = names.get(question),
+				count = int(present[:,i].sum()),
+				max_score = float(max_scores[i]),
+				mean = float(question_means[i]),
+				facility = to_number(facilities[i]),
+				discrimination = to_number(discriminations[i]),
+				distribution = distribution(scores[:,i]),
+			)
+			for i,question in enumerate(questions)
+		]
+
+		interactions = store.interactions
+		ids = store.interaction_ids
+		interaction_rows = store.interaction_rows(ids)
+		present = interaction_rows>=0
+		raw_scores = np.array([to_float(value) for value in interactions.raw_score.values])[interactions.raw_score.codes]
+		part_scores = np.nan_to_num(gather(raw_scores,interaction_rows))
+		max_scores = np.array([to_float(value) for value in interactions.max_score.values])[interactions.max_score.codes]
+		part_max_scores = np.fmax.reduce(gather(max_scores,interaction_rows),axis=0,initial=0)
+
+		part_means = means(part_scores)
+		with np.errstate(invalid='ignore',divide='ignore'):
+			facilities = part_means/part_max_scores
+		discriminations = item_rest_correlations(part_scores,totals)
+		responses = self.response_frequencies(interactions,raw_scores)
+		self.parts = []
+		for i,id in enumerate(ids):
+			parsed = parse_interaction_id(id)
+			frequencies,other_responses = responses.get(id,([],0))
+			self.parts.append(PartStatistics(
+				id = id,
+				question = parsed.question_number,
+				name = parsed.name,
+				count = int(present[:,i].sum()),
+				max_score = float(part_max_scores[i]),
+				mean = float(part_means[i]),
+				facility = to_number(facilities[i]),
+				discrimination = to_number(discriminations[i]),
+				distribution = distribution(part_scores[:,i]),
+				responses = frequencies,
+				other_responses = other_responses,
+			))
+
+		self.parts_by_question = defaultdict(list)
+		for part in self.parts:
+			self.parts_by_question[part.question].append(part)
+
+	# For each interaction id, the most common responses with how often each was given and its mean score, and how many other responses there were.
+	def response_frequencies(self,interactions,raw_scores):
+		groups = {}
+		labels = np.array([groups.setdefault(key,len(groups)) for key in zip(interactions.id.codes.tolist(),[response or '' for response in interactions.learner_response.tolist()])],dtype=np.int64)
+		counts = np.bincount(labels,minlength=len(groups))
+		score_totals = np.bincount(labels,weights=np.nan_to_num(raw_scores),minlength=len(groups))
+
+		by_id = defaultdict(list)
+		for (code,response),label in groups.items():
+			by_id[interactions.id.values[code]].append((int(counts[label]),response,float(score_totals[label])))
+
+		frequencies = {}
+		for id,responses in by_id.items():
+			num_given = sum(count for count,response,total in responses)
+			responses.sort(key=lambda r: -r[0])
+			common = responses[:num_responses]
+			frequencies[id] = (
+				[ResponseFrequency(response,count,count/num_given,total/count) for count,response,total in common],
+				num_given-sum(count for count,response,total in common)
+			)
+		return frequencies
+
+	def as_json(self):
+		return {
+			'num_attempts': self.num_attempts,
+			'cronbach_alpha': self.alpha,
+			'questions': [question._asdict() for question in self.questions],
+			'parts': [dict(part._asdict(),responses=[response._asdict() for response in part.responses]) for part in self.parts],
+		}
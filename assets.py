@@ -0,0 +1,158 @@
+# The files of SCORM packages, prepared so that browsers only need to download them once.
+# Every file in a course's packages is hashed and copied into a store in the assets directory, named by its hash, along with gzip and brotli-compressed copies of the files that compress well.
+# A package's files are served under a version made from the hashes of all of them, which changes whenever any of them does, so browsers can cache them forever.
+# Packages made by the same version of Numbas share most of their files, which are only stored once.
+#
+# Brotli-compressed copies are only made if the brotli package is installed.
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import threading
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+asset_root = 'assets'
+manifest_version = 1
+
+# files smaller than this aren't worth compressing
+min_compress_size = 1024
+
+# files are read in pieces of this many bytes, so a large media file is never held in memory all at once
+chunk_size = 1024*1024
+
+compressible_types = ('application/javascript','application/json','application/xml','image/svg+xml')
+
+# the suffix of the stored copy in each encoding, in order of preference
+encoding_suffixes = {
+	'br': '.br',
+	'gzip': '.gz',
+}
+
+def is_compressible(name):
+	mimetype,_ = mimetypes.guess_type(name)
+	return mimetype is not None and (mimetype.startswith('text/') or mimetype in compressible_types)
+
+def available_encodings():
+	return [encoding for encoding in encoding_suffixes if encoding!='br' or brotli is not None]
+
+# Compress the file at source into the file target, a piece at a time.
+def compress_file(source,target,encoding):
+	if encoding=='br':
+		compressor = brotli.Compressor()
+		for chunk in iter(lambda: source.read(chunk_size),b''):
+			target.write(compressor.process(chunk))
+		target.write(compressor.finish())
+	else:
+		with gzip.GzipFile(filename='',mode='wb',compresslevel=9,fileobj=target,mtime=0) as compressed:
+			shutil.copyfileobj(source,compressed,chunk_size)
+
+# The stored copy of the file with the given hash, compressed with encoding if it's given.
+def asset_path(digest,encoding=None):
+	return os.path.join(asset_root,digest[:2],digest+(encoding_suffixes[encoding] if encoding else ''))
+
+# Files are written to a temporary name and then moved into place, so a file that's being served is never half-written.
+def tmp_path_for(path):
+	os.makedirs(os.path.dirname(path),exist_ok=True)
+	return '{}.tmp-{}-{}'.format(path,os.getpid(),threading.get_ident())
+
+def write_file(path,data):
+	tmp_path = tmp_path_for(path)
+	with open(tmp_path,'wb') as f:
+		f.write(data)
+	os.replace(tmp_path,path)
+
+# Copy one of the course's files into the store, along with the compressed copies that are smaller than it.
+# The file is hashed while it's copied to a temporary name, and is then moved to the name made from its hash, unless the store already has it.
+# Returns the manifest's entry for the file.
+def store_file(storage,name):
+	tmp_path = tmp_path_for(os.path.join(asset_root,'incoming'))
+	hash = hashlib.sha1()
+	size = 0
+	with storage.open(name) as source, open(tmp_path,'wb') as target:
+		for chunk in iter(lambda: source.read(chunk_size),b''):
+			hash.update(chunk)
+			target.write(chunk)
+			size += len(chunk)
+	digest = hash.hexdigest()
+	path = asset_path(digest)
+	if os.path.exists(path):
+		os.remove(tmp_path)
+	else:
+		os.makedirs(os.path.dirname(path),exist_ok=True)
+		os.replace(tmp_path,path)
+
+	encodings = []
+	if size>=min_compress_size and is_compressible(name):
+		for encoding in available_encodings():
+			compressed_path = asset_path(digest,encoding)
+			if not os.path.exists(compressed_path):
+				tmp_path = tmp_path_for(compressed_path)
+				with open(path,'rb') as source, open(tmp_path,'wb') as target:
+					compress_file(source,target,encoding)
+				if os.path.getsize(tmp_path)>=size:
+					os.remove(tmp_path)
+					continue
+				os.replace(tmp_path,compressed_path)
+			encodings.append(encoding)
+
+	return {'stat': storage.stat(name), 'digest': digest, 'size': size, 'encodings': encodings}
+
+def manifest_filename(file_path):
+	key = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+	return os.path.join(asset_root,'manifests',key+'.json')
+
+def read_manifest(course):
+	try:
+		with open(manifest_filename(course.file_path)) as f:
+			manifest = json.load(f)
+	except (OSError,ValueError):
+		return None
+	return manifest if manifest.get('version')==manifest_version else None
+
+# Store every file in the course's SCORM packages, and write a manifest of them, which is returned.
+# Files which haven't changed since the last manifest was made aren't read again.
+# The manifest has an entry for each file, keyed by its path in the course, and the version of each package, keyed by the package's pk.
+def build_manifest(course):
+	old_files = (read_manifest(course) or {}).get('files',{})
+	files = {}
+	packages = {}
+	for scorm in course.scorms:
+		names = sorted(course.storage.names(scorm.pk))
+		for name in names:
+			entry = old_files.get(name)
+			if entry is None or entry['stat']!=course.storage.stat(name) or not os.path.exists(asset_path(entry['digest'])):
+				entry = store_file(course.storage,name)
+			files[name] = entry
+		packages[scorm.pk] = hashlib.sha1(json.dumps([[name,files[name]['digest']] for name in names]).encode('utf-8')).hexdigest()[:16]
+
+	manifest = {'version': manifest_version, 'files': files, 'packages': packages}
+	write_file(manifest_filename(course.file_path),json.dumps(manifest).encode('utf-8'))
+	return manifest
+
+def up_to_date(course,manifest):
+	if set(manifest['packages'])!=set(scorm.pk for scorm in course.scorms):
+		return False
+	files = manifest['files']
+	names = [name for scorm in course.scorms for name in course.storage.names(scorm.pk)]
+	return len(names)==len(files) and all(name in files and files[name]['stat']==course.storage.stat(name) for name in names)
+
+# The manifest of the course's package files, which is rebuilt if any of them have changed since it was made.
+def course_manifest(course):
+	manifest = read_manifest(course)
+	if manifest is None or not up_to_date(course,manifest):
+		manifest = build_manifest(course)
+	return manifest
+
+# The encoding to send a file in: the first of the file's compressed copies that the browser accepts, or None to send it uncompressed.
+def choose_encoding(entry,accept_encodings):
+	for encoding in entry['encodings']:
+		if accept_encodings[encoding]:
+			return encoding
+	return None
@@ -0,0 +1,57 @@
+# Measure how much memory a loaded SCORM package's attempts take up.
+# For comparison, the same attempts are also loaded as a dictionary for each attempt, objective and interaction, which is roughly how they were held before they were stored in columns.
+#
+#     python -m benchmarks.attempt_memory --users 2000
+
+import argparse
+import gc
+import os
+import tempfile
+import tracemalloc
+
+from blackboardscorm import BlackboardCourse, read_attempt_records, read_interaction_records
+from benchmarks.synthetic import make_course
+
+# Call load, and return what it returns, along with how many bytes that retains and the peak while loading.
+def measure(load):
+	gc.collect()
+	tracemalloc.start()
+	value = load()
+	gc.collect()
+	size,peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return value,size,peak
+
+def load_dicts(course,scorm):
+	records = read_attempt_records(course.storage,scorm.dat_filename)
+	interactions = read_interaction_records(course.storage,scorm.dat_filename)
+	return [dict(record._asdict(),objectives=[o._asdict() for o in record.objectives],interactions=[i._asdict() for i in interactions.get(record.pk,[])]) for record in records]
+
+def load_columns(scorm):
+	scorm.load()
+	scorm.store.interactions
+	return scorm.store
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the memory used by loaded attempts')
+	parser.add_argument('--users',type=int,default=2000)
+	parser.add_argument('--questions',type=int,default=5)
+	parser.add_argument('--parts',type=int,default=3)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		path = make_course(os.path.join(tmp,'course'),num_scorms=1,num_users=args.users,questions=args.questions,parts=args.parts)
+		course = BlackboardCourse(path)
+		course.users
+		scorm = course.scorms[0]
+
+		dicts,dict_size,dict_peak = measure(lambda: load_dicts(course,scorm))
+		num_attempts = len(dicts)
+		del dicts
+		store,size,peak = measure(lambda: load_columns(scorm))
+
+		print('{} attempts, {} questions of {} parts each, with their interactions'.format(num_attempts,args.questions,args.parts))
+		print('Dictionaries: {:,} bytes retained ({:,.0f} bytes per attempt), {:,} bytes at peak while loading'.format(dict_size,dict_size/num_attempts,dict_peak))
+		print('Columns: {:,} bytes retained ({:,.0f} bytes per attempt), {:,} bytes at peak while loading'.format(size,size/num_attempts,peak))
+		print('The columns themselves take {:,} bytes'.format(store.nbytes))
+		print('Columns use {:.0%} of the memory of dictionaries'.format(size/dict_size))
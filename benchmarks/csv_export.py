@@ -0,0 +1,52 @@
+# Measure how quickly a SCORM package's CSV export starts and finishes, and how much memory it takes to produce.
+#
+#     python -m benchmarks.csv_export --users 5000 --interactions
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import make_course
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the CSV export')
+	parser.add_argument('--users',type=int,default=5000)
+	parser.add_argument('--questions',type=int,default=5)
+	parser.add_argument('--parts',type=int,default=3)
+	parser.add_argument('--interactions',action='store_true',help='Include a column for each interaction')
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		path = make_course(os.path.join(tmp,'course'),num_scorms=1,num_users=args.users,questions=args.questions,parts=args.parts)
+		os.chdir(tmp)
+		with open('state.json','w') as f:
+			json.dump({'courses':[{'path':path}]},f)
+
+		import server
+		client = server.app.test_client()
+		course = server.state.courses[0]
+		scorm = course.scorms[0]
+		course.users
+		scorm.load()
+		url = '/course/{}/scorm/{}.csv{}'.format(course.pk,scorm.pk,'?interactions=1' if args.interactions else '')
+
+		tracemalloc.start()
+		start = time.perf_counter()
+		response = client.get(url,buffered=False)
+		chunks = iter(response.response)
+		size = len(next(chunks))
+		first_byte = time.perf_counter()-start
+		for chunk in chunks:
+			size += len(chunk)
+		total = time.perf_counter()-start
+		response.close()
+		current,peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+
+		print('{} attempts, {:,} bytes of CSV'.format(scorm.num_attempts,size))
+		print('Time to first byte: {:.3f}s'.format(first_byte))
+		print('Total time: {:.3f}s'.format(total))
+		print('Peak memory while exporting: {:,} bytes'.format(peak))
@@ -0,0 +1,32 @@
+# Measure how long the item analysis of a SCORM package takes.
+#
+#     python -m benchmarks.item_analysis --users 20000
+
+import argparse
+import os
+import tempfile
+import time
+
+from analysis import ItemAnalysis
+from blackboardscorm import BlackboardCourse
+from benchmarks.synthetic import make_course
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the item analysis of a SCORM package')
+	parser.add_argument('--users',type=int,default=20000)
+	parser.add_argument('--questions',type=int,default=5)
+	parser.add_argument('--parts',type=int,default=3)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		path = make_course(os.path.join(tmp,'course'),num_scorms=1,num_users=args.users,questions=args.questions,parts=args.parts)
+		course = BlackboardCourse(path)
+		scorm = course.scorms[0]
+		scorm.load()
+
+		start = time.perf_counter()
+		analysis = ItemAnalysis(scorm)
+		elapsed = time.perf_counter()-start
+
+		print('{} attempts, {} questions, {} parts'.format(scorm.num_attempts,len(analysis.questions),len(analysis.parts)))
+		print('Item analysis: {:.3f}s'.format(elapsed))
@@ -0,0 +1,42 @@
+# Compare looking up SCORM resources in a large manifest with XPath against the prebuilt ResourceIndex.
+#
+#     python -m benchmarks.manifest_index --resources 20000 --lookups 500
+
+import argparse
+import time
+
+from lxml import etree
+
+from blackboardscorm import ResourceIndex
+
+def make_manifest(num_resources):
+	resources = []
+	for i in range(num_resources):
+		kind = 'resource/x-plugin-scormengine' if i%2 else 'resource/x-bb-document'
+		resources.append('<resource bb:file="res{0:05d}.dat" bb:title="_{0}_1" identifier="res{0:05d}" type="{1}"/>'.format(i,kind))
+	return etree.fromstring('<manifest xmlns:bb="http://www.blackboard.com/content-packaging/"><resources>{}</resources></manifest>'.format(''.join(resources)))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark manifest resource lookups')
+	parser.add_argument('--resources',type=int,default=20000)
+	parser.add_argument('--lookups',type=int,default=500)
+	args = parser.parse_args()
+
+	manifest = make_manifest(args.resources)
+	content_ids = ['_{}_1'.format(i) for i in range(1,args.resources,2)][:args.lookups]
+
+	start = time.perf_counter()
+	for content_id in content_ids:
+		manifest.xpath('//resource[@type="resource/x-plugin-scormengine" and @bb:title="'+content_id+'"]',namespaces={'bb':'http://www.blackboard.com/content-packaging/'})[0]
+	xpath_time = time.perf_counter()-start
+
+	start = time.perf_counter()
+	index = ResourceIndex(manifest)
+	build_time = time.perf_counter()-start
+	for content_id in content_ids:
+		index.get('resource/x-plugin-scormengine',content_id)
+	index_time = time.perf_counter()-start
+
+	print('{} resources, {} lookups'.format(args.resources,len(content_ids)))
+	print('XPath:          {:.3f}s'.format(xpath_time))
+	print('ResourceIndex:  {:.3f}s (of which {:.3f}s building the index)'.format(index_time,build_time))
@@ -0,0 +1,36 @@
+# Measure how long it takes to parse every SCORM package in a course, against the number of worker processes.
+#
+#     python -m benchmarks.parallel_parse --scorms 16 --users 500
+
+import argparse
+import os
+import tempfile
+import time
+
+from blackboardscorm import BlackboardCourse
+from benchmarks.synthetic import make_course
+
+def time_load(path,workers):
+	course = BlackboardCourse(path)
+	start = time.perf_counter()
+	course.load_scorms(workers)
+	return time.perf_counter()-start
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark parallel parsing of SCORM packages')
+	parser.add_argument('--scorms',type=int,default=16)
+	parser.add_argument('--users',type=int,default=500)
+	parser.add_argument('--workers',type=int,nargs='+',default=[1,2,4,8])
+	parser.add_argument('--repeat',type=int,default=3)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		path = make_course(os.path.join(tmp,'course'),num_scorms=args.scorms,num_users=args.users)
+		print('{} SCORM packages, {} users, CPUs available: {}'.format(args.scorms,args.users,os.cpu_count()))
+		print('{:>8} {:>10} {:>8}'.format('workers','seconds','speedup'))
+		baseline = None
+		for workers in args.workers:
+			seconds = min(time_load(path,workers) for i in range(args.repeat))
+			if baseline is None:
+				baseline = seconds
+			print('{:>8} {:>10.3f} {:>7.2f}x'.format(workers,seconds,baseline/seconds))
@@ -0,0 +1,59 @@
+# Measure how long a SCORM package's attempts page takes to load, for each way of sorting it, for a page of results and for a search.
+#
+#     python -m benchmarks.scorm_page --attempts 10000 100000
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import make_course
+
+def timed(client,url,repeats):
+	times = []
+	for i in range(repeats):
+		start = time.perf_counter()
+		response = client.get(url)
+		times.append(time.perf_counter()-start)
+		assert response.status_code==200, url
+	return min(times),len(response.data)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the attempts page of a SCORM package')
+	parser.add_argument('--attempts',type=int,nargs='+',default=[10000,100000],help='How many attempts the package should have')
+	parser.add_argument('--attempts-per-user',type=int,default=2)
+	parser.add_argument('--questions',type=int,default=2)
+	parser.add_argument('--parts',type=int,default=1)
+	parser.add_argument('--repeats',type=int,default=5)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		paths = []
+		for attempts in args.attempts:
+			# each user makes between 1 and attempts_per_user attempts
+			num_users = round(2*attempts/(1+args.attempts_per_user))
+			paths.append(make_course(os.path.join(tmp,'course-{}'.format(attempts)),title='{} attempts'.format(attempts),num_scorms=1,num_users=num_users,attempts_per_user=args.attempts_per_user,questions=args.questions,parts=args.parts))
+		os.chdir(tmp)
+		with open('state.json','w') as f:
+			json.dump({'courses':[{'path':path} for path in paths]},f)
+
+		import server
+		client = server.app.test_client()
+		for course in server.state.courses:
+			scorm = course.scorms[0]
+			course.users
+			scorm.load()
+			url = '/course/{}/scorm/{}/'.format(course.pk,scorm.pk)
+			print('{} attempts'.format(scorm.num_attempts))
+
+			for sort in server.attempt_sort_keys:
+				start = time.perf_counter()
+				client.get(url+'?sort={}'.format(sort))
+				first = time.perf_counter()-start
+				best,size = timed(client,url+'?sort={}&order=desc'.format(sort),args.repeats)
+				print('  sort by {:<10} first request {:.3f}s, afterwards {:.3f}s, {:,} bytes'.format(sort,first,best,size))
+
+			for description,query in [('last page','?page=1000000'),('1000 per page','?page_size=1000'),('search','?q=given1')]:
+				best,size = timed(client,url+query,args.repeats)
+				print('  {:<20} {:.3f}s, {:,} bytes'.format(description,best,size))
@@ -0,0 +1,183 @@
+# Time the main jobs the tool does, end to end, on synthetic archives of several sizes, and compare them with a saved baseline.
+#
+#     python -m benchmarks.suite --save baseline.json
+#     python -m benchmarks.suite --baseline baseline.json
+#
+# Each benchmark runs in a fresh process, so that it starts with nothing loaded and its peak memory use can be measured.
+# Ingestion runs first, and leaves behind the state and the cache that the other benchmarks start from.
+# When comparing with a baseline, any benchmark that got slower or used more memory by more than the tolerance is flagged, and the script exits with status 1.
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import make_archive
+
+scales = {
+	'small': dict(num_scorms=4,num_users=200),
+	'medium': dict(num_scorms=8,num_users=2000),
+	'large': dict(num_scorms=8,num_users=10000,variables=40),
+}
+
+benchmarks = ('ingest','startup','view_scorm','charts','scorm_csv')
+
+# differences in time smaller than this many seconds are never flagged, since they're within the noise
+noise_floor = 0.02
+
+# The peak resident set size of this process, in bytes.
+def peak_rss():
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes, and macOS reports bytes
+	return rss if sys.platform=='darwin' else rss*1024
+
+def run_ingest():
+	for path in ('courses','cache','state.json'):
+		if os.path.isdir(path):
+			shutil.rmtree(path)
+		elif os.path.exists(path):
+			os.remove(path)
+	from blackboardscorm import State
+	from ingestion import IngestionQueue
+	state = State()
+	queue = IngestionQueue(state,'courses',workers=1)
+	# uploads are saved in the courses directory, as the server does
+	os.makedirs('courses')
+	upload_path = os.path.join('courses','archive.upload')
+	shutil.copy('archive.zip',upload_path)
+
+	start = time.perf_counter()
+	job = queue.submit('course',upload_path)
+	queue.executor.shutdown(wait=True)
+	seconds = time.perf_counter()-start
+	if job.phase!='done':
+		raise Exception('Ingestion failed: {}'.format(job.error))
+	return seconds
+
+def run_startup():
+	from blackboardscorm import State
+	start = time.perf_counter()
+	State()
+	return time.perf_counter()-start
+
+# The URLs that each benchmark of the server requests, for each SCORM package.
+server_urls = {
+	'view_scorm': ['/','/?sort=score&order=desc','/?q=given1'],
+	'charts': ['/start-times.svg','/start-times-sparkline.svg','/scores.svg','/score-sparkline.svg'],
+	'scorm_csv': ['.csv','.csv?interactions=1'],
+}
+
+# Request the benchmark's URLs for each of the course's SCORM packages, once the course's users and attempts have been loaded.
+def run_server(name):
+	import server
+	client = server.app.test_client()
+	course = server.state.use_course(server.state.courses[0].pk)
+	course.users
+	course.load_scorms()
+
+	start = time.perf_counter()
+	for scorm in course.scorms:
+		for url in server_urls[name]:
+			response = client.get('/course/{}/scorm/{}{}'.format(course.pk,scorm.pk,url))
+			response.get_data()
+			response.close()
+			if response.status_code!=200:
+				raise Exception('{} returned {}'.format(url,response.status_code))
+	return time.perf_counter()-start
+
+def run_benchmark(name,path):
+	os.chdir(path)
+	if name=='ingest':
+		seconds = run_ingest()
+	elif name=='startup':
+		seconds = run_startup()
+	else:
+		seconds = run_server(name)
+	return {'seconds': seconds, 'peak_rss': peak_rss()}
+
+# Run a benchmark in a fresh process several times, keeping the fastest time and smallest peak memory use.
+def measure(name,path,repeats):
+	results = []
+	for i in range(repeats):
+		output = subprocess.run([sys.executable,'-m','benchmarks.suite','--run',name,'--dir',path],check=True,stdout=subprocess.PIPE,universal_newlines=True).stdout
+		results.append(json.loads(output.strip().splitlines()[-1]))
+	return {key: min(result[key] for result in results) for key in ('seconds','peak_rss')}
+
+def change(value,base):
+	return '{:+.0%}'.format(value/base-1) if base else ''
+
+# Whether the result is worse than the baseline by more than the tolerance.
+def regressed(result,base,tolerance):
+	slower = result['seconds']>base['seconds']*(1+tolerance) and result['seconds']-base['seconds']>noise_floor
+	bigger = result['peak_rss']>base['peak_rss']*(1+tolerance)
+	return slower or bigger
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Run the end-to-end benchmarks')
+	parser.add_argument('--scales',nargs='+',choices=list(scales),default=['small','medium'],help='Which sizes of archive to run the benchmarks on')
+	parser.add_argument('--benchmarks',nargs='+',choices=benchmarks,default=list(benchmarks))
+	parser.add_argument('--repeats',type=int,default=3)
+	parser.add_argument('--save',help='Save the results to this file, to use as a baseline later')
+	parser.add_argument('--baseline',help='Compare the results with the ones saved in this file')
+	parser.add_argument('--tolerance',type=float,default=0.2,help='How much slower or bigger a result can be than the baseline before it\'s flagged, as a fraction')
+	parser.add_argument('--run',help=argparse.SUPPRESS)
+	parser.add_argument('--dir',help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.run:
+		print(json.dumps(run_benchmark(args.run,args.dir)))
+		sys.exit()
+
+	baseline = {}
+	if args.baseline:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+
+	names = [name for name in benchmarks if name in args.benchmarks]
+	# everything else starts from the state that ingestion leaves behind
+	if 'ingest' not in names:
+		names.insert(0,'ingest')
+
+	results = {}
+	regressions = []
+	print('{:<8} {:<12} {:>9} {:>9} {:>8} {:>9} {:>9} {:>8}'.format('scale','benchmark','seconds','baseline','change','RSS MB','baseline','change'))
+	with tempfile.TemporaryDirectory() as tmp:
+		for scale in args.scales:
+			path = os.path.join(tmp,scale)
+			os.makedirs(path)
+			make_archive(os.path.join(path,'archive.zip'),**scales[scale])
+			scale_baseline = baseline.get(scale,{})
+			if scale_baseline and scale_baseline.get('parameters')!=scales[scale]:
+				print('The {} archive has changed since the baseline was saved, so it isn\'t compared.'.format(scale))
+				scale_baseline = {}
+			results[scale] = {'parameters': scales[scale]}
+
+			for name in names:
+				result = results[scale][name] = measure(name,path,1 if name=='ingest' and name not in args.benchmarks else args.repeats)
+				if name not in args.benchmarks:
+					continue
+				base = scale_baseline.get(name)
+				flag = ''
+				if base and regressed(result,base,args.tolerance):
+					flag = 'REGRESSION'
+					regressions.append((scale,name))
+				print('{:<8} {:<12} {:>9.3f} {:>9} {:>8} {:>9.1f} {:>9} {:>8} {}'.format(
+					scale,name,
+					result['seconds'],'{:.3f}'.format(base['seconds']) if base else '',change(result['seconds'],base['seconds']) if base else '',
+					result['peak_rss']/1e6,'{:.1f}'.format(base['peak_rss']/1e6) if base else '',change(result['peak_rss'],base['peak_rss']) if base else '',
+					flag
+				))
+
+	if args.save:
+		with open(args.save,'w') as f:
+			json.dump(results,f,indent=4)
+		print('Results saved to {}'.format(args.save))
+
+	if regressions:
+		print('{} regression{} against the baseline: {}'.format(len(regressions),'' if len(regressions)==1 else 's',', '.join('{} {}'.format(scale,name) for scale,name in regressions)))
+		sys.exit(1)
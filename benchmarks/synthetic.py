@@ -0,0 +1,159 @@
+# Write synthetic Blackboard course archives, laid out the way the archive tool extracts them, for benchmarking.
+# An archive can also be written as a zip file, like the ones that Blackboard produces, by running this as a script:
+#
+#     python -m benchmarks.synthetic course.zip --scorms 8 --users 2000 --folders 3 --gaps 2
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import zipfile
+from datetime import datetime,timedelta
+from xml.sax.saxutils import quoteattr
+
+def write(path,text):
+	with open(path,'w',encoding='utf-8') as f:
+		f.write(text)
+
+def user_xml(userid,i,rnd):
+	return '<USER id={}><USERNAME value="user{}"/><STUDENTID value="{}"/><NAMES><GIVEN value="Given{}"/><MIDDLE value=""/><FAMILY value="Family{}"/></NAMES><EMAILADDRESS value="user{}@example.com"/></USER>'.format(quoteattr(userid),i,100000+i,i,rnd.randint(0,999),i)
+
+def interaction_xml(id,q,score,rnd):
+	return '<ActivityRunTimeInteraction Id="{}" Description="numberentry" Type="9" LearnerResponse="{}" Weighting="1" ResultNumeric="{}"><Objective Id="q{}"/><CorrectResponse value="{}"/></ActivityRunTimeInteraction>'.format(id,rnd.randint(0,20),score,q,rnd.randint(0,20))
+
+# With gaps=0, every part has a single interaction, except the last part of each question, which is the first gap of a gap-fill.
+# Otherwise, each part is a gap-fill with that many gaps, each scoring one mark, with an interaction for each gap.
+# variables is how many question variables are saved in each question's suspend data, which is most of the size of an attempt.
+def registration_xml(scorm_number,registration_number,userid,instance,rnd,questions,parts,gaps=0,variables=10):
+	objectives = []
+	interactions = []
+	question_data = []
+	total = 0
+	marks = parts*max(gaps,1)
+	for q in range(questions):
+		question_score = 0
+		for p in range(parts):
+			if gaps:
+				for g in range(gaps):
+					score = rnd.choice((0,1))
+					question_score += score
+					interactions.append(interaction_xml('q{}p{}g{}'.format(q,p,g),q,score,rnd))
+			else:
+				score = rnd.choice((0,1))
+				question_score += score
+				gap = 'g0' if p==parts-1 else ''
+				interactions.append(interaction_xml('q{}p{}{}'.format(q,p,gap),q,score,rnd))
+		total += question_score
+		objectives.append('<ActivityRunTimeObjective Identifier="q{}" Description="Question {}" CompletionStatus="5" SuccessStatus="{}" ProgressMeasure="1" ScoreRaw="{}" ScoreMin="0" ScoreMax="{}" ScoreScaled="{}"/>'.format(q,q+1,3 if question_score==marks else 2,question_score,marks,question_score/marks))
+		question_data.append({
+			'submitted': 1,
+			'answered': question_score>0,
+			'variables': {'v{}'.format(i): str(rnd.randint(1,100)) for i in range(variables)},
+		})
+	maximum = questions*marks
+	suspend_data = json.dumps({'questions': question_data})
+	start_time = datetime(2016,1,1)+timedelta(days=rnd.randint(0,60),seconds=rnd.randint(0,86400))
+	return '<registration scorm_registration_id="{}-{}" mappedUserId={} instanceId="{}"><activities><Activity ItemIdentifier="item_1" AttemptExperiencedDurationTracked="{}" AttemptStartTimestampUtc="{}"><ActivityRunTime CompletionStatus="5" SuccessStatus="{}" ScoreScaled="{}" ScoreRaw="{}" ScoreMin="0" ScoreMax="{}" Location="" TotalTimeTracked="{}" SuspendData={}>{}{}</ActivityRunTime></Activity></activities></registration>'.format(
+		scorm_number,registration_number,quoteattr(userid),instance,
+		rnd.randint(1000,500000),start_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]+'Z',
+		3 if total*2>=maximum else 2,total/maximum,total,maximum,rnd.uniform(10,5000),quoteattr(suspend_data),
+		''.join(objectives),''.join(interactions)
+	)
+
+# The SCORM packages are put straight into the course's table of contents, or with folders>0, shared out between that many folders, each of which also holds an ordinary document.
+def make_course(path,title='Synthetic course',num_scorms=4,num_users=100,attempts_per_user=2,questions=5,parts=3,gaps=0,variables=10,folders=0,seed=0):
+	rnd = random.Random(seed)
+	os.makedirs(path,exist_ok=True)
+
+	resources = []
+	items = []
+	def add_resource(identifier,kind,bb_title):
+		resources.append('<resource bb:file="{0}.dat" bb:title={1} identifier="{0}" type="{2}"/>'.format(identifier,quoteattr(bb_title),kind))
+
+	add_resource('res00001','course/x-bb-coursesetting',title)
+	write(os.path.join(path,'res00001.dat'),'<COURSE id="_1_1"><TITLE value={}/></COURSE>'.format(quoteattr(title)))
+
+	userids = ['_{}_1'.format(1000+i) for i in range(num_users)]
+	add_resource('res00002','course/x-bb-user','Users')
+	write(os.path.join(path,'res00002.dat'),'<USERS>{}</USERS>'.format(''.join(user_xml(userid,i,rnd) for i,userid in enumerate(userids))))
+
+	add_resource('res00003','course/x-bb-coursetoc','Content')
+	write(os.path.join(path,'res00003.dat'),'<COURSETOC id="_2_1"><LABEL value="Content"/></COURSETOC>')
+
+	folder_items = [[] for f in range(folders)]
+	for f in range(folders):
+		document_ref = 'doc{:05d}'.format(f)
+		document_title = 'Notes {}'.format(f+1)
+		add_resource(document_ref,'resource/x-bb-document',document_title)
+		write(os.path.join(path,document_ref+'.dat'),'<CONTENT id="_{}_1"><TITLE value={}/><CONTENTHANDLER value="resource/x-bb-document"/></CONTENT>'.format(7000+f,quoteattr(document_title)))
+		folder_items[f].append('<item identifier="itm{0}" identifierref="{0}"><title>{1}</title></item>'.format(document_ref,document_title))
+
+	for s in range(num_scorms):
+		content_id = '_{}_1'.format(5000+s)
+		content_ref = 'res{:05d}'.format(4+2*s)
+		scorm_ref = 'res{:05d}'.format(5+2*s)
+		scorm_title = 'Test {}'.format(s+1)
+
+		add_resource(content_ref,'resource/x-bb-document',scorm_title)
+		write(os.path.join(path,content_ref+'.dat'),'<CONTENT id="{}"><TITLE value={}/><CONTENTHANDLER value="resource/x-plugin-scormengine"/></CONTENT>'.format(content_id,quoteattr(scorm_title)))
+		item = '<item identifier="itm{0}" identifierref="{0}"><title>{1}</title></item>'.format(content_ref,scorm_title)
+		if folders:
+			folder_items[s%folders].append(item)
+		else:
+			items.append(item)
+
+		add_resource(scorm_ref,'resource/x-plugin-scormengine',content_id)
+		registrations = []
+		for userid in userids:
+			for instance in range(rnd.randint(1,attempts_per_user)):
+				registrations.append(registration_xml(s,len(registrations),userid,instance,rnd,questions,parts,gaps,variables))
+		write(os.path.join(path,scorm_ref+'.dat'),'<scormItem mappedContentId="{}"><title>{}</title><registrations>{}</registrations></scormItem>'.format(content_id,scorm_title,''.join(registrations)))
+
+		os.makedirs(os.path.join(path,content_id),exist_ok=True)
+		write(os.path.join(path,content_id,'index.html'),'<!doctype html><html><head><title>{0}</title></head><body>{0}</body></html>'.format(scorm_title))
+
+	for f,subitems in enumerate(folder_items):
+		folder_ref = 'fld{:05d}'.format(f)
+		folder_title = 'Folder {}'.format(f+1)
+		add_resource(folder_ref,'resource/x-bb-document',folder_title)
+		write(os.path.join(path,folder_ref+'.dat'),'<CONTENT id="_{}_1"><TITLE value={}/><CONTENTHANDLER value="resource/x-bb-folder"/></CONTENT>'.format(8000+f,quoteattr(folder_title)))
+		items.append('<item identifier="itm{0}" identifierref="{0}"><title>{1}</title>{2}</item>'.format(folder_ref,folder_title,''.join(subitems)))
+
+	manifest = '<?xml version="1.0" encoding="UTF-8"?><manifest identifier="man00001" xmlns:bb="http://www.blackboard.com/content-packaging/"><organizations default="toc00001"><organization identifier="toc00001"><item identifier="itm00003" identifierref="res00003"><title>Content</title><item identifier="itm00000"><title>--TOP--</title>{}</item></item></organization></organizations><resources>{}</resources></manifest>'.format(''.join(items),''.join(resources))
+	write(os.path.join(path,'imsmanifest.xml'),manifest)
+
+	return path
+
+# Write a course archive as a zip file, as it's downloaded from Blackboard.
+def make_archive(zip_path,**kwargs):
+	with tempfile.TemporaryDirectory() as tmp:
+		path = make_course(os.path.join(tmp,'course'),**kwargs)
+		with zipfile.ZipFile(zip_path,'w',zipfile.ZIP_DEFLATED) as zip:
+			for root,dirs,files in os.walk(path):
+				for name in files:
+					filename = os.path.join(root,name)
+					zip.write(filename,os.path.relpath(filename,path).replace(os.sep,'/'))
+	return zip_path
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Write a synthetic Blackboard course archive')
+	parser.add_argument('output',help='A .zip file, or a directory to write the extracted archive to')
+	parser.add_argument('--title',default='Synthetic course')
+	parser.add_argument('--scorms',type=int,default=4)
+	parser.add_argument('--users',type=int,default=100)
+	parser.add_argument('--attempts-per-user',type=int,default=2)
+	parser.add_argument('--questions',type=int,default=5)
+	parser.add_argument('--parts',type=int,default=3)
+	parser.add_argument('--gaps',type=int,default=0,help='How many gaps each part has. With 0, only the last part of each question has a gap.')
+	parser.add_argument('--variables',type=int,default=10,help='How many variables are saved in the suspend data for each question')
+	parser.add_argument('--folders',type=int,default=0,help='How many folders to share the SCORM packages out between')
+	parser.add_argument('--seed',type=int,default=0)
+	args = parser.parse_args()
+
+	options = dict(title=args.title,num_scorms=args.scorms,num_users=args.users,attempts_per_user=args.attempts_per_user,questions=args.questions,parts=args.parts,gaps=args.gaps,variables=args.variables,folders=args.folders,seed=args.seed)
+	if args.output.endswith('.zip'):
+		make_archive(args.output,**options)
+	else:
+		make_course(args.output,**options)
+	print('Wrote {} ({:,} bytes)'.format(args.output,os.path.getsize(args.output) if os.path.isfile(args.output) else sum(os.path.getsize(os.path.join(root,name)) for root,dirs,files in os.walk(args.output) for name in files)))
@@ -1,10 +1,23 @@
 from lxml import etree
+import numpy as np
 import json
 import os
 import re
+import hashlib
+import pickle
+import threading
+import multiprocessing
+import shutil
+import sys
+from contextlib import contextmanager
+from collections import OrderedDict,defaultdict,namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from columns import StringColumn,CategoryColumn,column,save_columns,load_columns
+import metrics
 import zipfile
 from itertools import groupby
-from datetime import datetime,timedelta
+from functools import lru_cache
+from datetime import datetime,timedelta,timezone
 from unicodedata import normalize
 from random import choice
 
@@ -53,65 +66,578 @@ def fuzz(s):
 
 
 
+# Stream through a SCORM .dat file, yielding its top-level <title> and each of its <registration> elements.
+# Each registration is thrown away once it's been read, so memory use doesn't grow with the size of the file.
+def read_scorm_file(source):
+	for event,element in etree.iterparse(source,tag=('title','registration'),huge_tree=True):
+		parent = element.getparent()
+		if element.tag=='title':
+			if parent.getparent() is None:
+				yield element
+		else:
+			yield element
+			element.clear()
+			while element.getprevious() is not None:
+				del parent[0]
+
 class SCORM(object):
-	def __init__(self,course,doc):
+	# attributes which are only filled in once the attempts have been loaded
+	lazy_attributes = ('store','attempts','objective_ids','num_attempts','attempts_by_pk','attempts_by_user','statistics','sort_orders','user_index','suspend_data_cache')
+
+	# how many attempts' decoded suspend data to keep
+	suspend_data_cache_size = 64
+
+	def __init__(self,course,dat_filename):
 		self.course = course
-		self.doc = doc
-		self.pk = doc.xpath('/scormItem')[0].get('mappedContentId')
-		self.title = self.doc.xpath('/scormItem/title')[0].text
-
-		registrations = self.doc.xpath('//registration')
-		self.attempts = sorted([Attempt(self,registration) for registration in registrations],key=lambda a:a.userid)
-		self.objective_ids = list(set(sum([list(a.objectives_by_id.keys()) for a in self.attempts],[])))
-		self.num_attempts = len(self.attempts)
-		self.attempts_by_pk = {a.pk:a for a in self.attempts}
-		
+		self.dat_filename = dat_filename
+		self.size = course.file_size(dat_filename)
+
+		with course.open_stream(dat_filename) as f, metrics.phase('scorm_title'):
+			for element in read_scorm_file(f):
+				if element.tag=='title':
+					self.pk = element.getparent().get('mappedContentId')
+					self.title = element.text
+					break
+
+	def __getattr__(self,name):
+		if name in SCORM.lazy_attributes:
+			self.load()
+			return self.__dict__[name]
+		raise AttributeError(name)
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		for name in SCORM.lazy_attributes:
+			state.pop(name,None)
+		return state
+
+	@property
+	def loaded(self):
+		return 'attempts' in self.__dict__
+
+	# The directory that the attempts have been saved in, either in the course's snapshot or its attempt cache, or None if they haven't been saved.
+	def saved_path(self):
+		root = self.course.snapshot or self.course.attempt_cache
+		if root is None:
+			return None
+		path = os.path.join(root,self.pk)
+		return path if os.path.isdir(path) else None
+
+	# Load the attempts from the given records or an already-built store.
+	# If there aren't either, they're loaded from where they were saved, or read from the .dat file if they haven't been saved.
+	# Unless the course has a snapshot, attempts that weren't loaded from the attempt cache are saved there.
+	def load(self,records=None,store=None):
+		with self.course.lock:
+			if self.loaded:
+				return
+			storage,dat_filename = self.course.storage,self.dat_filename
+			read_interactions = lambda: read_interaction_records(storage,dat_filename)
+			saved = False
+			if store is None and records is None:
+				path = self.saved_path()
+				if path is not None:
+					with metrics.phase('snapshot' if self.course.snapshot else 'attempt_cache'):
+						store = AttemptStore.load(path,read_interactions)
+					saved = True
+			if store is None:
+				if records is None:
+					with metrics.phase('attempt_records',self.size):
+						records = read_attempt_records(storage,dat_filename)
+				with metrics.phase('attempt_store'):
+					store = AttemptStore(records,read_interactions)
+				metrics.count_rows('attempts',len(store))
+				metrics.count_rows('objectives',len(store.objectives))
+			if not saved and self.course.snapshot is None and self.course.attempt_cache is not None:
+				path = os.path.join(self.course.attempt_cache,self.pk)
+				with metrics.phase('save_attempts'):
+					store.save(path)
+				store.path = path
+			with metrics.phase('attempt_index'):
+				self.store = store
+				self.attempts = [Attempt(self,row) for row in range(len(self.store))]
+				self.objective_ids = np.unique(self.store.objectives.question).tolist()
+				self.num_attempts = len(self.attempts)
+				self.attempts_by_pk = {a.pk:a for a in self.attempts}
+				# the store is sorted by user id, so each user's attempts are a contiguous run of rows, and user codes are numbered in the same order
+				user_start = row_offsets(np.bincount(self.store.userid.codes,minlength=len(self.store.userid.values)))
+				self.attempts_by_user = {userid:self.attempts[user_start[i]:user_start[i+1]] for i,userid in enumerate(self.store.userid.values)}
+				self.statistics = SCORMStatistics(self.store)
+				self.sort_orders = {}
+				self.user_index = None
+				self.suspend_data_cache = BoundedCache(SCORM.suspend_data_cache_size)
+			self.course.users.want(self.store.userid.values)
+
+	def unload(self):
+		for name in SCORM.lazy_attributes:
+			self.__dict__.pop(name,None)
+
 	def attempts_for_user(self,userid):
-		return [a for a in self.attempts if a.userid==userid]
+		return self.attempts_by_user.get(userid,[])
+
+	# For each attempt, the rank of its user's value of the given attribute among this package's users.
+	def user_ranks(self,attribute):
+		users = self.course.users
+		return ranks([getattr(users.user(userid),attribute) for userid in self.store.userid.values])[self.store.userid.codes]
+
+	# The rows of the attempts, sorted by one of the keys in attempt_sort_keys.
+	# Each order is worked out once, the first time it's asked for.
+	def sort_order(self,key,descending=False):
+		if (key,descending) not in self.sort_orders:
+			columns = attempt_sort_keys[key](self.store,self.user_ranks)
+			rank = ranks_of_rows(columns)
+			self.sort_orders[key,descending] = np.argsort(-rank if descending else rank,kind='stable')
+		return self.sort_orders[key,descending]
+
+	# A boolean mask of the attempts by users whose name or username contains the query.
+	def user_rows(self,query):
+		if self.user_index is None:
+			users = self.course.users
+			self.user_index = UserSearchIndex([users.user(userid).fullname+'\n'+users.user(userid).username for userid in self.store.userid.values])
+		return np.isin(self.store.userid.codes,self.user_index.search(query))
+
+# The rank of each value among the distinct values in the list.
+def ranks(values):
+	lookup = {value:i for i,value in enumerate(sorted(set(values)))}
+	return np.array([lookup[value] for value in values],dtype=np.int64)
+
+# The rank of each row of a table among its distinct rows, when sorted by the given columns, most significant first.
+# Rows with equal keys have equal rank, so a stable sort by rank keeps them in their original order in either direction.
+def ranks_of_rows(columns):
+	order = np.lexsort(columns[::-1])
+	changed = np.zeros(len(order),dtype=bool)
+	for values in columns:
+		values = values[order]
+		changed[1:] |= values[1:]!=values[:-1]
+	rank = np.empty(len(order),dtype=np.int64)
+	rank[order] = np.cumsum(changed)
+	return rank
+
+# The columns to sort a package's attempts by for each sort key, most significant first.
+# Each is given the attempt store and a function giving the rank of each attempt's user by an attribute of the user.
+attempt_sort_keys = {
+	'name': lambda store,user_ranks: (user_ranks('last_name'),user_ranks('first_name'),store.start_time.view(np.int64)),
+	'username': lambda store,user_ranks: (user_ranks('username'),store.start_time.view(np.int64)),
+	'score': lambda store,user_ranks: (store.scaled_score,user_ranks('last_name'),user_ranks('first_name'),store.number),
+	'starttime': lambda store,user_ranks: (store.start_time.view(np.int64),),
+	'duration': lambda store,user_ranks: (store.duration,),
+	'attempt': lambda store,user_ranks: (store.number,user_ranks('last_name'),user_ranks('first_name'),store.start_time.view(np.int64)),
+}
+
+# An index for finding the users whose names contain a piece of text.
+# The names are lowercased and joined into one string, which is searched with str.find, and the position of each match is mapped back to the user it's in.
+class UserSearchIndex(object):
+	def __init__(self,names):
+		names = [name.lower().replace('\0','') for name in names]
+		self.text = '\0'.join(names)
+		self.starts = row_offsets([len(name)+1 for name in names])
+
+	# The positions in the list of names of the names containing the query.
+	def search(self,query):
+		query = query.lower().replace('\0','')
+		found = []
+		i = self.text.find(query)
+		while i!=-1:
+			n = int(np.searchsorted(self.starts,i,side='right'))-1
+			found.append(n)
+			i = self.text.find(query,self.starts[n+1])
+		return np.array(found,dtype=np.int32)
+
+# A dictionary which only keeps the most recently used items.
+class BoundedCache(object):
+	def __init__(self,size):
+		self.size = size
+		self.items = OrderedDict()
+		self.lock = threading.Lock()
+
+	# Get the item with the given key, or make it by calling make if it's not there.
+	def get(self,key,make):
+		with self.lock:
+			if key in self.items:
+				self.items.move_to_end(key)
+				return self.items[key]
+		value = make()
+		with self.lock:
+			self.items[key] = value
+			while len(self.items)>self.size:
+				self.items.popitem(last=False)
+		return value
+
+# Summary statistics of a SCORM package's attempts, computed once with numpy when the attempts are loaded.
+class SCORMStatistics(object):
+	score_bins = 10
+
+	def __init__(self,store):
+		start_times = store.start_time[~np.isnat(store.start_time)]
+
+		# attempts in each tenth of the score range: the last bin stops short of 100%
+		edges = np.arange(self.score_bins+1)/self.score_bins
+		bins = np.searchsorted(edges,store.scaled_score,side='right')-1
+		bins = bins[(bins>=0) & (bins<self.score_bins)]
+		self.score_histogram = np.bincount(bins,minlength=self.score_bins).tolist()
+
+		# attempts started on each day between the first and last start times, including days with none
+		days = start_times.astype('datetime64[D]')
+		if len(days):
+			offsets = (days-days.min()).astype(int)
+			counts = np.bincount(offsets)
+			self.start_days = (days.min()+np.arange(len(counts))).astype('datetime64[us]').tolist()
+			self.start_counts = counts.tolist()
+		else:
+			self.start_days = []
+			self.start_counts = []
+
+		self.objectives = self.objective_statistics(store.objectives)
+
+	def objective_statistics(self,objectives):
+		if not len(objectives):
+			return []
+		raw_scores = objectives.raw_score
+		max_scores = objectives.max_score
+
+		order = np.argsort(objectives.question,kind='stable')
+		numbers,starts = np.unique(objectives.question[order],return_index=True)
+		statistics = []
+		for number,scores,maxima,first in zip(numbers,np.split(raw_scores[order],starts[1:]),np.split(max_scores[order],starts[1:]),order[starts]):
+			lower_quartile,median,upper_quartile = np.percentile(scores,[25,50,75])
+			statistics.append(ObjectiveStatistics(
+				question = int(number),
+				name = objectives.name[first],
+				count = len(scores),
+				max_score = float(maxima.max()),
+				mean = float(scores.mean()),
+				median = float(median),
+				lower_quartile = float(lower_quartile),
+				upper_quartile = float(upper_quartile),
+				facility = float(scores.sum()/maxima.sum()) if maxima.sum()>0 else 0,
+			))
+		return statistics
+
+ObjectiveStatistics = namedtuple('ObjectiveStatistics',('question','name','count','max_score','mean','median','lower_quartile','upper_quartile','facility'))
+
+# Compact, picklable records of the data in a SCORM .dat file, which can be read in a worker process and sent back to be stored in an AttemptStore.
+AttemptRecord = namedtuple('AttemptRecord',('pk','userid','instance','duration','completion_status','success_status','scaled_score','raw_score','min_score','max_score','start_time','location','total_time','suspend_data','objectives'))
+ObjectiveRecord = namedtuple('ObjectiveRecord',('id','name','question','completion_status','success_status','progress_measure','raw_score','min_score','max_score','scaled_score'))
+InteractionRecord = namedtuple('InteractionRecord',('id','part_type','interaction_type','learner_response','max_score','raw_score','objective','correct_response'))
+
+def read_attempt(element):
+	activity = element.xpath('activities/Activity[@ItemIdentifier="item_1"]')[0]
+	activity_run_time = activity.xpath('ActivityRunTime')[0]
+
+	start_time = activity.get('AttemptStartTimestampUtc')
+	objectives = sorted([read_objective(objective) for objective in activity_run_time.xpath('ActivityRunTimeObjective')],key=lambda o: o.question)
+
+	return AttemptRecord(
+		pk = element.get('scorm_registration_id'),
+		userid = element.get('mappedUserId'),
+		instance = int(element.get('instanceId')),
+		duration = round(float(activity.attrib.get('AttemptExperiencedDurationTracked','.'))/100),
+		completion_status = int(activity_run_time.get('CompletionStatus')),
+		success_status = int(activity_run_time.get('SuccessStatus')),
+		scaled_score = float(activity_run_time.get('ScoreScaled','0')),
+		raw_score = float(activity_run_time.get('ScoreRaw','0')),
+		min_score = float(activity_run_time.get('ScoreMin','0')),
+		max_score = float(activity_run_time.get('ScoreMax','0')),
+		start_time = datetime.strptime(start_time,'%Y-%m-%dT%H:%M:%S.%fZ') if start_time else None,
+		location = activity_run_time.get('Location'),
+		total_time = float(activity_run_time.get('TotalTimeTracked')),
+		suspend_data = activity_run_time.get('SuspendData',''),
+		objectives = objectives,
+	)
+
+def read_objective(element):
+	id = element.get('Identifier')
+	m = re.match(r'^q(?P<question>\d+)',id)
+	question = int(m.group('question'))+1
+	return ObjectiveRecord(
+		id = id,
+		name = element.get('Description'),
+		question = question,
+		completion_status = int(element.get('CompletionStatus')),
+		success_status = int(element.get('SuccessStatus')),
+		progress_measure = float(element.get('ProgressMeasure')),
+		raw_score = float(element.get('ScoreRaw')),
+		min_score = float(element.get('ScoreMin')),
+		max_score = float(element.get('ScoreMax')),
+		scaled_score = float(element.get('ScoreScaled','0')),
+	)
+
+def read_interaction(element):
+	objective = element.find('Objective')
+	correct_response = element.find('CorrectResponse')
+	return InteractionRecord(
+		id = element.get('Id'),
+		part_type = element.get('Description'),
+		interaction_type = int(element.get('Type')),
+		learner_response = element.get('LearnerResponse'),
+		max_score = element.get('Weighting'),
+		raw_score = element.get('ResultNumeric'),
+		objective = objective.get('Id') if objective is not None else None,
+		correct_response = correct_response.get('value') if correct_response is not None else '',
+	)
+
+# Read the records of all the attempts in a SCORM .dat file, apart from their interactions, which are read separately by read_interaction_records when they're first needed.
+# This is a plain function so that it can be run in a worker process.
+def read_attempt_records(storage,dat_filename):
+	with storage.open(dat_filename) as f:
+		return [read_attempt(element) for element in read_scorm_file(f) if element.tag=='registration']
+
+# Read the interactions of every attempt in a SCORM .dat file, as a dictionary mapping registration ids to lists of records.
+# Only the interaction and registration elements are handed to Python, which is much quicker than reading whole registrations.
+def read_interaction_records(storage,dat_filename):
+	interactions = {}
+	current = []
+	with storage.open(dat_filename) as f, metrics.phase('interaction_records',storage.size(dat_filename)):
+		for event,element in etree.iterparse(f,tag=('ActivityRunTimeInteraction','registration'),huge_tree=True):
+			if element.tag=='registration':
+				interactions[element.get('scorm_registration_id')] = current
+				current = []
+				parent = element.getparent()
+				element.clear()
+				while element.getprevious() is not None:
+					del parent[0]
+			elif element.getparent().getparent().get('ItemIdentifier')=='item_1':
+				current.append(read_interaction(element))
+	return interactions
+
+# Write a directory by calling write with a temporary path, and then moving it into place.
+# If another thread or process has written the directory in the meantime, theirs is kept, since it might already be in use.
+def save_directory(write,path):
+	tmp_path = '{}.tmp-{}-{}'.format(path,os.getpid(),threading.get_ident())
+	shutil.rmtree(tmp_path,ignore_errors=True)
+	write(tmp_path)
+	try:
+		os.replace(tmp_path,path)
+	except OSError:
+		shutil.rmtree(tmp_path,ignore_errors=True)
+
+# Start offsets of each attempt's rows in a child table, followed by the total number of rows.
+def row_offsets(counts):
+	offsets = np.zeros(len(counts)+1,dtype=np.int64)
+	np.cumsum(counts,out=offsets[1:])
+	return offsets
+
+# The attempts at a SCORM package, stored column by column.
+# Attempts are sorted by user id. The objectives and interactions of attempt i are rows objective_start[i] to objective_start[i+1] of the objectives table, and the same for interactions.
+# The interactions take longer to read than everything else put together, and most pages don't need them, so they're only read when they're first used, by calling read_interactions.
+class AttemptStore(object):
+	lazy_attributes = ('interaction_start','interactions')
+
+	# the directory the store has been saved in, if any, which the interactions are also saved to once they've been read
+	path = None
+
+	def __init__(self,records,read_interactions):
+		records = sorted(records,key=lambda r: r.userid)
+		self.read_interactions = read_interactions
+		self.lock = threading.Lock()
+
+		self.pk = StringColumn([r.pk for r in records])
+		self.userid = CategoryColumn([r.userid for r in records])
+		self.number = np.array([r.instance+1 for r in records],dtype=np.int32)
+		self.duration = np.array([r.duration for r in records],dtype=np.int64)
+		self.completion_status = np.array([r.completion_status for r in records],dtype=np.int8)
+		self.success_status = np.array([r.success_status for r in records],dtype=np.int8)
+		self.scaled_score = np.array([r.scaled_score for r in records],dtype=np.float64)
+		self.raw_score = np.array([r.raw_score for r in records],dtype=np.float64)
+		self.min_score = np.array([r.min_score for r in records],dtype=np.float64)
+		self.max_score = np.array([r.max_score for r in records],dtype=np.float64)
+		self.start_time = np.array([r.start_time for r in records],dtype='datetime64[us]')
+		self.location = StringColumn([r.location for r in records])
+		self.total_time = np.array([r.total_time for r in records],dtype=np.float64)
+		self.suspend_data = StringColumn([r.suspend_data for r in records])
+
+		self.objective_start = row_offsets([len(r.objectives) for r in records])
+		self.objectives = ObjectiveTable([o for r in records for o in r.objectives])
+
+	def __getattr__(self,name):
+		if name in AttemptStore.lazy_attributes:
+			with self.lock:
+				if name not in self.__dict__:
+					self.load_interactions()
+			return self.__dict__[name]
+		raise AttributeError(name)
+
+	def load_interactions(self):
+		interactions_by_pk = self.read_interactions()
+		with metrics.phase('interaction_store'):
+			interactions = [interactions_by_pk.get(self.pk[row],[]) for row in range(len(self))]
+			self.interactions = InteractionTable([i for attempt in interactions for i in attempt])
+			self.interaction_start = row_offsets([len(attempt) for attempt in interactions])
+		metrics.count_rows('interactions',len(self.interactions))
+		if self.path is not None:
+			save_directory(self.save_interactions,os.path.join(self.path,'interactions'))
+
+	@property
+	def interactions_loaded(self):
+		return 'interactions' in self.__dict__
+
+	# Save the store's columns in the directory path, so that it can be loaded again with AttemptStore.load.
+	# The interactions are only saved if they've been read, or with interactions=True, in which case they're read first.
+	def save(self,path,interactions=False):
+		if interactions:
+			self.interactions
+		def save(path):
+			save_columns(self,os.path.join(path,'attempts'),skip=AttemptStore.lazy_attributes)
+			save_columns(self.objectives,os.path.join(path,'objectives'))
+			if self.interactions_loaded:
+				self.save_interactions(os.path.join(path,'interactions'))
+		save_directory(save,path)
+
+	def save_interactions(self,path):
+		save_columns(self.interactions,path)
+		np.save(os.path.join(path,'start.npy'),self.interaction_start)
+
+	# Load a store saved by AttemptStore.save. Its columns are memory-mapped from the saved files.
+	# If the interactions weren't saved, they're read by calling read_interactions when they're first used, and then saved too.
+	@classmethod
+	def load(cls,path,read_interactions=None):
+		store = load_columns(cls.__new__(cls),os.path.join(path,'attempts'))
+		store.read_interactions = read_interactions
+		store.lock = threading.Lock()
+		store.path = path
+		store.objectives = load_columns(ObjectiveTable.__new__(ObjectiveTable),os.path.join(path,'objectives'))
+		interactions_path = os.path.join(path,'interactions')
+		if os.path.isdir(interactions_path):
+			store.interactions = load_columns(InteractionTable.__new__(InteractionTable),interactions_path)
+			store.interaction_start = np.load(os.path.join(interactions_path,'start.npy'),mmap_mode='r')
+		return store
+
+	def __len__(self):
+		return len(self.number)
+
+	# Rows of the objectives table for attempts start to stop, as a matrix with one row per attempt and one column per question number, and -1 where an attempt has no objective for that question.
+	def objective_rows(self,questions,start=0,stop=None):
+		stop = len(self) if stop is None else stop
+		first,last = self.objective_start[start],self.objective_start[stop]
+		lookup = np.full(max(questions,default=0)+1,-1,dtype=np.int64)
+		lookup[questions] = np.arange(len(questions))
+		question = self.objectives.question[first:last]
+		columns = np.where(question<len(lookup),lookup[np.minimum(question,len(lookup)-1)],-1)
+		return self.child_rows(self.objective_start,start,stop,columns,len(questions))
+
+	# Rows of the interactions table for attempts start to stop, as a matrix with one row per attempt and one column per interaction id, and -1 where an attempt has no such interaction.
+	def interaction_rows(self,ids,start=0,stop=None):
+		stop = len(self) if stop is None else stop
+		first,last = self.interaction_start[start],self.interaction_start[stop]
+		positions = {id:i for i,id in enumerate(ids)}
+		lookup = np.array([positions.get(id,-1) for id in self.interactions.id.values]+[-1],dtype=np.int64)
+		columns = lookup[self.interactions.id.codes[first:last]]
+		return self.child_rows(self.interaction_start,start,stop,columns,len(ids))
+
+	def child_rows(self,offsets,start,stop,columns,width):
+		first,last = offsets[start],offsets[stop]
+		attempt_rows = np.repeat(np.arange(stop-start),np.diff(offsets[start:stop+1]))
+		rows = np.full((stop-start,width),-1,dtype=np.int64)
+		found = columns>=0
+		rows[attempt_rows[found],columns[found]] = np.arange(first,last)[found]
+		return rows
+
+	# The distinct interaction ids, in question, part, gap and step order.
+	@property
+	def interaction_ids(self):
+		def key(id):
+			parsed = parse_interaction_id(id)
+			return (parsed.question_number,parsed.part,parsed.gap or 0,parsed.step or 0)
+		return sorted(self.interactions.id.values,key=key)
+
+	@property
+	def nbytes(self):
+		tables = (self,self.objectives,self.interactions) if self.interactions_loaded else (self,self.objectives)
+		return sum(column.nbytes for table in tables for column in table.__dict__.values() if hasattr(column,'nbytes'))
+
+class ObjectiveTable(object):
+	def __init__(self,records):
+		self.id = CategoryColumn([r.id for r in records])
+		self.name = CategoryColumn([r.name for r in records])
+		self.question = np.array([r.question for r in records],dtype=np.int32)
+		self.completion_status = np.array([r.completion_status for r in records],dtype=np.int8)
+		self.success_status = np.array([r.success_status for r in records],dtype=np.int8)
+		self.progress_measure = np.array([r.progress_measure for r in records],dtype=np.float64)
+		self.raw_score = np.array([r.raw_score for r in records],dtype=np.float64)
+		self.min_score = np.array([r.min_score for r in records],dtype=np.float64)
+		self.max_score = np.array([r.max_score for r in records],dtype=np.float64)
+		self.scaled_score = np.array([r.scaled_score for r in records],dtype=np.float64)
+
+	def __len__(self):
+		return len(self.question)
+
+class InteractionTable(object):
+	def __init__(self,records):
+		self.id = CategoryColumn([r.id for r in records])
+		self.part_type = CategoryColumn([r.part_type for r in records])
+		self.interaction_type = np.array([r.interaction_type for r in records],dtype=np.int8)
+		self.learner_response = StringColumn([r.learner_response for r in records])
+		self.max_score = CategoryColumn([r.max_score for r in records])
+		self.raw_score = CategoryColumn([r.raw_score for r in records])
+		self.objective = CategoryColumn([r.objective for r in records])
+		self.correct_response = StringColumn([r.correct_response for r in records])
+
+	def __len__(self):
+		return len(self.interaction_type)
+
+def to_datetime(value):
+	return None if np.isnat(value) else value.item()
+
+# Attempt, Objective and Interaction are views of one row of an AttemptStore's tables.
 
 class Attempt(object):
-	def __init__(self,scorm,element):
+	__slots__ = ('scorm','table','row')
+
+	def __init__(self,scorm,row):
 		self.scorm = scorm
-		self.element = element
-		activity = element.xpath('activities/Activity[@ItemIdentifier="item_1"]')[0]
-		activity_run_time = activity.xpath('ActivityRunTime')[0]
+		self.table = scorm.store
+		self.row = row
 
-		self.pk = element.get('scorm_registration_id')
-		self.userid = element.get('mappedUserId')
-		self.number = int(element.get('instanceId'))+1
+	pk = column()
+	userid = column()
+	number = column(int)
+	duration = column(lambda seconds: timedelta(seconds=int(seconds)))
+	completion_status = column(lambda code: completion_statuses[code])
+	success_status = column(lambda code: success_statuses[code])
+	scaled_score = column(float)
+	raw_score = column(float)
+	min_score = column(float)
+	max_score = column(float)
+	start_time = column(to_datetime)
+	location = column()
+	total_time = column(float)
 
-		self.user = self.scorm.course.users[self.userid]
+	@property
+	def user(self):
+		return self.scorm.course.users.user(self.userid)
 
-		self.duration = timedelta(seconds=round(float(activity.attrib.get('AttemptExperiencedDurationTracked','.'))/100))
+	# the suspend data as it was saved, before it's decoded
+	raw_suspend_data = property(lambda self: self.table.suspend_data[self.row])
 
-		completion_status = int(activity_run_time.get('CompletionStatus'))
-		self.completion_status = completion_statuses[completion_status]
+	# The suspend data is kept as a string, and decoded when it's needed. The decoded data is shared, so it mustn't be changed.
+	@property
+	def suspend_data(self):
+		return self.scorm.suspend_data_cache.get(self.row,self.decode_suspend_data)
 
-		success_status = int(activity_run_time.get('SuccessStatus'))
-		self.success_status = success_statuses[success_status]
+	def decode_suspend_data(self):
+		suspend_data = self.raw_suspend_data
+		with metrics.phase('suspend_data',len(suspend_data or '')):
+			return json.loads(suspend_data) if suspend_data else None
 
-		self.scaled_score = float(activity_run_time.get('ScoreScaled','0'))
-		self.raw_score = float(activity_run_time.get('ScoreRaw','0'))
-		self.min_score = float(activity_run_time.get('ScoreMin','0'))
-		self.max_score = float(activity_run_time.get('ScoreMax','0'))
-		start_time = activity.get('AttemptStartTimestampUtc')
-		self.start_time = datetime.strptime(start_time,'%Y-%m-%dT%H:%M:%S.%fZ') if start_time else None
-		self.location = activity_run_time.get('Location')
-		self.total_time = float(activity_run_time.get('TotalTimeTracked'))
-		
-		suspend_data = activity_run_time.get('SuspendData','')
-		self.suspend_data = json.loads(suspend_data) if suspend_data else None
-		
-		self.objectives = sorted([Objective(self,objective) for objective in activity_run_time.xpath('ActivityRunTimeObjective')],key=lambda o: o.question)
-		self.objectives_by_id = {o.question:o for o in self.objectives}
+	@property
+	def objectives(self):
+		return [Objective(self,row) for row in range(self.table.objective_start[self.row],self.table.objective_start[self.row+1])]
+
+	@property
+	def objectives_by_id(self):
+		return {o.question:o for o in self.objectives}
 
-		self.interactions = [Interaction(interaction) for interaction in activity_run_time.xpath('ActivityRunTimeInteraction')]
-		self.interactions_by_id = {i.id:i for i in self.interactions}
+	@property
+	def interactions(self):
+		return [Interaction(self,row) for row in range(self.table.interaction_start[self.row],self.table.interaction_start[self.row+1])]
 
-		for interaction in self.interactions:
-			interaction.question = self.objectives_by_id.get(interaction.question_number)
+	@property
+	def interactions_by_id(self):
+		return {i.id:i for i in self.interactions}
 
-		self.interactions_by_question = [(self.objectives_by_id.get(q,-1),sorted(list(interactions),key=lambda i:(i.part,i.gap or 0))) for q,interactions in groupby(self.interactions,key=lambda i: i.question_number)]
+	@property
+	def interactions_by_question(self):
+		objectives_by_id = self.objectives_by_id
+		return [(objectives_by_id.get(q,-1),sorted(list(interactions),key=lambda i:(i.part,i.gap or 0))) for q,interactions in groupby(self.interactions,key=lambda i: i.question_number)]
 
 type_names = {
 	'information': 'Information only',
@@ -125,119 +651,564 @@ type_names = {
 	'm_n_x': 'Match choices with answers',
 }
 
+interaction_types = [
+	'',
+	'true-false',
+	'choice',
+	'fill-in',
+	'long-fill-in',
+	'matching',
+	'performance',
+	'sequencing',
+	'likert',
+	'numeric',
+	'other',
+]
+
+InteractionId = namedtuple('InteractionId',('question_number','part','gap','step','name'))
+
+# Interaction ids are the same for every attempt at a package, so each one only needs to be parsed once.
+@lru_cache(maxsize=4096)
+def parse_interaction_id(id):
+	m = re.match(r'q(?P<question>\d+)p(?P<part>\d+)(?:g(?P<gap>\d+))?(?:s(?P<step>\d+))?',id)
+	question_number = int(m.group('question'))+1
+	part = int(m.group('part'))
+	gap = int(m.group('gap')) if m.group('gap') else None
+	step = int(m.group('step')) if m.group('step') else None
+
+	name = 'Part {}'.format(alphabet[part])
+	if gap is not None:
+		name += ', gap {}'.format(gap)
+	if step is not None:
+		name += ', step {}'.format(step)
+
+	return InteractionId(question_number,part,gap,step,name)
+
 class Interaction(object):
-	def __init__(self,element):
-		self.element = element
-		self.part_type = element.get('Description')
-		self.part_type_name = type_names.get(self.part_type,self.part_type)
-		interaction_type = int(element.get('Type'))
-		interaction_types = [
-			'',
-			'true-false',
-			'choice',
-			'fill-in',
-			'long-fill-in',
-			'matching',
-			'performance',
-			'sequencing',
-			'likert',
-			'numeric',
-			'other',
-		]
-		self.interaction_type = interaction_types[interaction_type]
-		self.id = element.get('Id')
-
-		m = re.match(r'q(?P<question>\d+)p(?P<part>\d+)(?:g(?P<gap>\d+))?(?:s(?P<step>\d+))?',self.id)
-		self.question_number = int(m.group('question'))+1
-		self.part = int(m.group('part'))
-		self.gap = int(m.group('gap')) if m.group('gap') else None
-		self.step = int(m.group('step')) if m.group('step') else None
-
-		self.name = 'Part {}'.format(alphabet[self.part])
-		if self.gap is not None:
-			self.name += ', gap {}'.format(self.gap)
-		if self.step is not None:
-			self.name += ', step {}'.format(self.step)
-
-		self.learner_response = element.get('LearnerResponse')
-		self.max_score = element.get('Weighting')
-		self.raw_score = element.get('ResultNumeric')
-		objective = element.xpath('Objective')
-		self.objective = objective[0].get('Id') if objective else None
-		correct_response = element.xpath('CorrectResponse')
-		self.scorm_correct_response = correct_response[0].get('value') if len(correct_response) else ''
+	__slots__ = ('attempt','table','row')
+
+	def __init__(self,attempt,row):
+		self.attempt = attempt
+		self.table = attempt.table.interactions
+		self.row = row
+
+	id = column()
+	part_type = column()
+	interaction_type = column(lambda code: interaction_types[code])
+	learner_response = column()
+	max_score = column()
+	raw_score = column()
+	objective = column()
+	scorm_correct_response = property(lambda self: self.table.correct_response[self.row])
 
+	@property
+	def part_type_name(self):
+		return type_names.get(self.part_type,self.part_type)
+
+	question_number = property(lambda self: parse_interaction_id(self.id).question_number)
+	part = property(lambda self: parse_interaction_id(self.id).part)
+	gap = property(lambda self: parse_interaction_id(self.id).gap)
+	step = property(lambda self: parse_interaction_id(self.id).step)
+	name = property(lambda self: parse_interaction_id(self.id).name)
+
+	@property
+	def question(self):
+		return self.attempt.objectives_by_id.get(self.question_number)
+
+	@property
+	def correct_response(self):
 		if self.scorm_correct_response:
-			self.correct_response = re.sub(r'^{case_matters=.*}{order_matters=.*}','',self.scorm_correct_response)
+			return re.sub(r'^{case_matters=.*}{order_matters=.*}','',self.scorm_correct_response)
+		else:
+			return ''
 		
 class Objective(object):
-	def __init__(self,attempt,element):
+	__slots__ = ('attempt','table','row')
+
+	def __init__(self,attempt,row):
 		self.attempt = attempt
-		self.element = element
-		self.id = element.get('Identifier')
-		self.name = element.get('Description')
-		completion_status = int(element.get('CompletionStatus'))
-		self.completion_status = completion_statuses[completion_status]
-		success_status = int(element.get('SuccessStatus'))
-		self.success_status = success_statuses[success_status]
-		self.progress_measure = float(element.get('ProgressMeasure'))
-		self.raw_score = float(element.get('ScoreRaw'))
-		self.min_score = float(element.get('ScoreMin'))
-		self.max_score = float(element.get('ScoreMax'))
-		self.scaled_score = float(element.get('ScoreScaled','0'))
-		self.percent_score = self.raw_score/self.max_score if self.max_score>0 else 0
-
-		m = re.match(r'^q(?P<question>\d+)',self.id)
-		self.question = int(m.group('question'))+1
-
-		self.suspend_data = self.attempt.suspend_data['questions'][self.question-1]
-		self.submitted = self.suspend_data['submitted']
-		self.answered = self.suspend_data['answered']
+		self.table = attempt.table.objectives
+		self.row = row
+
+	id = column()
+	name = column()
+	question = column(int)
+	completion_status = column(lambda code: completion_statuses[code])
+	success_status = column(lambda code: success_statuses[code])
+	progress_measure = column(float)
+	raw_score = column(float)
+	min_score = column(float)
+	max_score = column(float)
+	scaled_score = column(float)
+
+	@property
+	def percent_score(self):
+		return self.raw_score/self.max_score if self.max_score>0 else 0
+
+	@property
+	def suspend_data(self):
+		return self.attempt.suspend_data['questions'][self.question-1]
+
+	# These come from the suspend data, which is only decoded when it's needed, and then kept in the package's suspend data cache.
+	submitted = property(lambda self: int(self.suspend_data['submitted']))
+	answered = property(lambda self: bool(self.suspend_data['answered']))
  
+# The attributes of User that are read from the children of a <USER> element, and of its <NAMES> element.
+user_fields = {
+	'USERNAME': 'username',
+	'STUDENTID': 'studentid',
+	'EMAILADDRESS': 'email',
+	'GIVEN': 'first_name',
+	'MIDDLE': 'middle_name',
+	'FAMILY': 'last_name',
+}
+
 class User(object):
-	def __init__(self,element):
-		self.element = element
-		self.id = element.get('id')
-		self.username = fuzz(element.xpath('USERNAME')[0].get('value'))
-		self.studentid = fuzz(element.xpath('STUDENTID')[0].get('value'))
-		self.first_name = fuzz(element.xpath('NAMES/GIVEN')[0].get('value'))
-		self.middle_name = fuzz(element.xpath('NAMES/MIDDLE')[0].get('value'))
-		self.last_name = fuzz(element.xpath('NAMES/FAMILY')[0].get('value'))
-		self.fullname = '{}{} {}'.format(self.first_name,' '+self.middle_name if self.middle_name else '',self.last_name)
-		self.email = fuzz(element.xpath('EMAILADDRESS')[0].get('value'))
+	__slots__ = ('id','username','studentid','first_name','middle_name','last_name','email','missing')
+
+	def __init__(self,id,username='',studentid='',first_name='',middle_name='',last_name='',email='',missing=False):
+		self.id = id
+		self.username = username
+		self.studentid = studentid
+		self.first_name = first_name
+		self.middle_name = middle_name
+		self.last_name = last_name
+		self.email = email
+		# True for a user who has made attempts but isn't in the course's user file
+		self.missing = missing
+
+	# Read a user from a <USER> element, in one pass over its children.
+	# Names and ids are shared by lots of users and attempts, so they're interned.
+	@classmethod
+	def from_element(cls,element):
+		fields = {}
+		for child in element:
+			if child.tag=='NAMES':
+				for name in child:
+					if name.tag in user_fields:
+						fields[user_fields[name.tag]] = sys.intern(fuzz(name.get('value') or ''))
+			elif child.tag in user_fields:
+				fields[user_fields[child.tag]] = fuzz(child.get('value') or '')
+		return cls(sys.intern(element.get('id')),**fields)
+
+	@property
+	def fullname(self):
+		if self.missing:
+			return 'Unknown user {}'.format(self.id)
+		return '{}{} {}'.format(self.first_name,' '+self.middle_name if self.middle_name else '',self.last_name)
+
+# Stream through a course's user file, yielding a User for each <USER> element whose id is in userids, or every one if userids is None.
+def read_users(source,userids=None):
+	for event,element in etree.iterparse(source,tag='USER',huge_tree=True):
+		if userids is None or element.get('id') in userids:
+			yield User.from_element(element)
+		parent = element.getparent()
+		element.clear()
+		while element.getprevious() is not None:
+			del parent[0]
+
+# A course's users, read from its user file as they're needed.
+# Courses often list thousands of users who never attempted a SCORM package, so only the users who made attempts at the packages that have been loaded are read, until every user is asked for.
+# A user who made attempts but isn't in the user file, as happens when a student unenrols, is stood in for by a User with missing=True.
+class CourseUsers(object):
+	def __init__(self,storage,filename):
+		self.storage = storage
+		self.filename = filename
+		self.users = {}
+		# ids of users who've made attempts at the loaded packages
+		self.wanted = set()
+		# ids which have been looked for in the user file
+		self.searched = set()
+		self.placeholders = {}
+		self.complete = False
+		self.lock = threading.Lock()
+
+	# Note the ids of users who've made attempts, so they're read the next time the user file is.
+	def want(self,userids):
+		with self.lock:
+			self.wanted.update(userids)
 
+	# Read every wanted user who hasn't already been looked for, in one pass over the user file.
+	def resolve(self,userid=None):
+		with self.lock:
+			if self.complete:
+				return
+			if userid is not None:
+				self.wanted.add(userid)
+			userids = self.wanted-self.searched
+			if not userids:
+				return
+			self.read(userids)
+			self.searched |= userids
+
+	# Read the users with the given ids, or every user if userids is None. Users who've already been read are kept, and when every user is read, they're put in the order of the file.
+	def read(self,userids=None):
+		with self.storage.open(self.filename) as f, metrics.phase('users',self.storage.size(self.filename)):
+			users = {user.id:self.users.get(user.id,user) for user in read_users(f,userids)}
+		# the dictionary is replaced rather than changed, so it can be read without taking the lock
+		users = users if userids is None else {**self.users,**users}
+		metrics.count_rows('users',len(users)-len(self.users))
+		self.users = users
+
+	def read_all(self):
+		with self.lock:
+			if not self.complete:
+				self.read()
+				self.complete = True
+
+	def get(self,userid,default=None):
+		if userid not in self.users and userid not in self.searched:
+			self.resolve(userid)
+		return self.users.get(userid,default)
+
+	def __getitem__(self,userid):
+		user = self.get(userid)
+		if user is None:
+			raise KeyError(userid)
+		return user
+
+	def __contains__(self,userid):
+		return self.get(userid) is not None
+
+	# The user with the given id, or a stand-in if they're not in the user file.
+	def user(self,userid):
+		user = self.get(userid)
+		if user is None:
+			with self.lock:
+				user = self.placeholders.setdefault(userid,User(userid,missing=True))
+		return user
+
+	def values(self):
+		self.read_all()
+		return self.users.values()
+
+	def __len__(self):
+		self.read_all()
+		return len(self.users)
+
+	# Whether any of the user file has been read.
+	@property
+	def read_any(self):
+		return self.complete or bool(self.searched)
+
+bb_namespace = '{http://www.blackboard.com/content-packaging/}'
+
+Resource = namedtuple('Resource',('identifier','type','title','file'))
+
+# An index of the resources in a course's manifest, built in one pass, so that looking a resource up doesn't mean searching the whole manifest.
+class ResourceIndex(object):
+	def __init__(self,manifest):
+		self.by_identifier = {}
+		self.by_type = defaultdict(list)
+		self.by_type_and_title = {}
+
+		for element in manifest.iter('resource'):
+			resource = Resource(element.get('identifier'),element.get('type'),element.get(bb_namespace+'title'),element.get(bb_namespace+'file'))
+			self.by_identifier.setdefault(resource.identifier,resource)
+			self.by_type[resource.type].append(resource)
+			self.by_type_and_title.setdefault((resource.type,resource.title),resource)
+
+	def first_of_type(self,type):
+		return self.by_type[type][0]
+
+	def get(self,type,title):
+		return self.by_type_and_title[(type,title)]
+
+# An item in a course's table of contents. Only what's needed to show the hierarchy is kept: the item's XML is read from its .dat file when it's asked for, by BlackboardCourse.item_xml.
 class HierarchyItem(object):
-	def __init__(self,title):
+	__slots__ = ('title','ref','kind','contenthandler','subitems','scorm')
+
+	def __init__(self,title,ref):
 		self.title = title
+		self.ref = ref
 		self.subitems = []
 		self.scorm = None
 
+ItemHeader = namedtuple('ItemHeader',('tag','id','contenthandler'))
+
+# Read what the hierarchy needs from a content item's .dat file: the tag and id of its root element, and for a CONTENT item, its content handler.
+# The file is only read as far as the content handler, and the elements before it are thrown away, so the body of a long document isn't kept.
+def read_item_header(source):
+	tag = id = None
+	for event,element in etree.iterparse(source,events=('start','end')):
+		if tag is None:
+			tag,id = element.tag,element.get('id')
+			if tag!='CONTENT':
+				break
+		elif event=='end':
+			if element.tag=='CONTENTHANDLER':
+				return ItemHeader(tag,id,element.get('value'))
+			element.clear()
+	return ItemHeader(tag,id,None)
+
+# The files making up a course, either extracted into a directory or read straight out of the archive zip file.
+
+# The manifest and the .dat files are all that gets parsed, so they're all that's looked at to decide if a course has changed.
+def is_source_file(name):
+	return name=='imsmanifest.xml' or name.endswith('.dat')
+
+class DirectoryStorage(object):
+	def __init__(self,path):
+		self.path = path
+
+	def open(self,name):
+		return open(os.path.join(self.path,name),'rb')
+
+	def size(self,name):
+		return os.path.getsize(os.path.join(self.path,name))
+
+	# The names of the files in the directory prefix, relative to the top of the course.
+	def names(self,prefix):
+		names = []
+		for root,dirs,files in os.walk(os.path.join(self.path,prefix)):
+			for name in files:
+				names.append(os.path.relpath(os.path.join(root,name),self.path).replace(os.sep,'/'))
+		return names
+
+	# Something about the file which changes whenever its contents do.
+	def stat(self,name):
+		stat = os.stat(os.path.join(self.path,name))
+		return [stat.st_mtime_ns,stat.st_size]
+
+	def signature(self):
+		signature = []
+		for name in sorted(os.listdir(self.path)):
+			if is_source_file(name):
+				stat = os.stat(os.path.join(self.path,name))
+				signature.append((name,stat.st_mtime_ns,stat.st_size))
+		return signature
+
+class ZipStorage(object):
+	def __init__(self,path):
+		self.path = path
+		self._zip = None
+
+	# The zip file is opened the first time it's needed, so that a storage object can be sent to a worker process, which opens its own copy.
+	@property
+	def zip(self):
+		if self._zip is None:
+			self._zip = zipfile.ZipFile(self.path)
+		return self._zip
+
+	def __getstate__(self):
+		return {'path': self.path, '_zip': None}
+
+	def open(self,name):
+		return self.zip.open(name)
+
+	def size(self,name):
+		return self.zip.getinfo(name).file_size
+
+	def names(self,prefix):
+		prefix = prefix.rstrip('/')+'/'
+		return [info.filename for info in self.zip.infolist() if info.filename.startswith(prefix) and not info.is_dir()]
+
+	def stat(self,name):
+		info = self.zip.getinfo(name)
+		return [info.CRC,info.file_size]
+
+	def signature(self):
+		stat = os.stat(self.path)
+		return [(os.path.basename(self.path),stat.st_mtime_ns,stat.st_size)]
+
+def open_storage(path):
+	if os.path.isfile(path) and zipfile.is_zipfile(path):
+		return ZipStorage(path)
+	else:
+		return DirectoryStorage(path)
+
+# Pools of processes that SCORM packages are parsed in, keyed by the number of processes.
+# A pool is started the first time it's needed, and then kept for as long as this process runs, so that the server doesn't start new processes every time it loads a course.
+parse_pools = {}
+parse_pools_lock = threading.Lock()
+
+# The server has threads running and courses loaded by the time a pool is started, so the workers aren't forked from it: they're started by a fork server, or spawned where there isn't one, and only import what they need.
+def parse_context():
+	return multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+def parse_pool(workers):
+	with parse_pools_lock:
+		if workers not in parse_pools:
+			parse_pools[workers] = ProcessPoolExecutor(max_workers=workers,mp_context=parse_context())
+		return parse_pools[workers]
+
 class BlackboardCourse(object):
+	# the directory of the snapshot that attempts are loaded from, if there is one
+	snapshot = None
+
+	# the directory that the SCORM packages' attempts are saved in once they've been parsed, if they're cached
+	attempt_cache = None
+
+	# attributes which are only filled in once the course's data has been loaded, and the methods which load them
+	lazy_attributes = {
+		'users': 'load_users',
+		'scorms_by_user': 'index_users',
+	}
+
 	def __init__(self,file_path):
 		self.file_path = file_path
-		manifest = self.open_file('imsmanifest.xml')
-		self.doc = etree.fromstring(manifest)
+		self.storage = open_storage(file_path)
+		self.modified = datetime.fromtimestamp(max(mtime for name,mtime,size in self.storage.signature())/1e9,timezone.utc)
+		self.lock = threading.RLock()
+		with metrics.phase('manifest',self.file_size('imsmanifest.xml')):
+			self.doc = etree.fromstring(self.open_file('imsmanifest.xml'))
+			self.resources = ResourceIndex(self.doc)
 
-		self.title = self.doc.xpath('//resource[@type="course/x-bb-coursesetting"]')[0].get('{http://www.blackboard.com/content-packaging/}title')
+		self.title = self.resources.first_of_type('course/x-bb-coursesetting').title
 		self.slug = self.pk = slugify(self.title)
 
 		self.scorms = []
 		self.scorms_by_pk = {}
 
-		self.load_users()
-		self.load_hierarchy()
+		self.user_filename = self.resources.first_of_type('course/x-bb-user').file
+		# the id of each user in the course, by username, so a user can be found in every course without loading them
+		with self.storage.open(self.user_filename) as f, metrics.phase('usernames',self.file_size(self.user_filename)):
+			self.userids_by_username = {user.username:user.id for user in read_users(f)}
+		with metrics.phase('hierarchy'):
+			self.load_hierarchy()
+
+		# the manifest is only needed while loading, and lxml documents can't be pickled into the cache
+		del self.doc
+
+	def __getattr__(self,name):
+		if name in BlackboardCourse.lazy_attributes:
+			with self.lock:
+				if name not in self.__dict__:
+					getattr(self,BlackboardCourse.lazy_attributes[name])()
+			return self.__dict__[name]
+		raise AttributeError(name)
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['lock']
+		for name in BlackboardCourse.lazy_attributes:
+			state.pop(name,None)
+		return state
+
+	def __setstate__(self,state):
+		self.__dict__.update(state)
+		self.lock = threading.RLock()
+
+	# An estimate of how much memory the course is using, in terms of the size of the files that have been parsed.
+	@property
+	def loaded_size(self):
+		size = sum(scorm.size for scorm in self.scorms if scorm.loaded)
+		if 'users' in self.__dict__ and self.users.read_any:
+			size += self.file_size(self.user_filename)
+		return size
+
+	# Load every SCORM package's attempts. Packages are read in parallel when workers>1, or None to use one worker per CPU.
+	# Packages whose attempts have been saved, in the course's snapshot or its attempt cache, are loaded from there in this process instead, since that's much quicker than parsing them, and memory-mapped columns are shared with other processes.
+	# If given, progress is called with each SCORM package once it's been loaded.
+	# If given, only the packages in scorms are loaded.
+	def load_scorms(self,workers=None,progress=None,scorms=None):
+		scorms = [scorm for scorm in (self.scorms if scorms is None else scorms) if not scorm.loaded]
+		saved = [scorm for scorm in scorms if scorm.saved_path() is not None]
+		for scorm in saved:
+			scorm.load()
+			if progress:
+				progress(scorm)
+		scorms = [scorm for scorm in scorms if scorm not in saved]
+
+		workers = workers or os.cpu_count()
+		if workers==1 or len(scorms)<=1:
+			for scorm in scorms:
+				scorm.load()
+				if progress:
+					progress(scorm)
+			return
+		results = parse_pool(workers).map(metrics.timed_call,[read_attempt_records]*len(scorms),[self.storage]*len(scorms),[scorm.dat_filename for scorm in scorms])
+		for scorm,(records,seconds) in zip(scorms,results):
+			metrics.record_phase('attempt_records',seconds,scorm.size)
+			scorm.load(records)
+			if progress:
+				progress(scorm)
+
+	# Write every SCORM package's attempts to a snapshot at path, and load them from there from now on.
+	# The snapshot is written to a temporary directory and then moved into place.
+	# Older snapshots of the course are left alone, since other processes might still load from them until they see the new version of the state file. They're removed by remove_old_snapshots.
+	def publish_snapshot(self,path,workers=None):
+		self.load_scorms(workers)
+		tmp_path = '{}.tmp-{}'.format(path,os.getpid())
+		shutil.rmtree(tmp_path,ignore_errors=True)
+		os.makedirs(tmp_path)
+		for scorm in self.scorms:
+			scorm.store.save(os.path.join(tmp_path,scorm.pk),interactions=True)
+		shutil.rmtree(path,ignore_errors=True)
+		os.replace(tmp_path,path)
+
+		self.snapshot = path
+		for scorm in self.scorms:
+			scorm.unload()
+
+	# Remove the snapshots and cached attempts of older versions of the course's files.
+	# This should only be done once the state file has been saved, so that other processes pick up the new snapshot before they need to load anything.
+	def remove_old_versions(self):
+		for path in (self.snapshot,self.attempt_cache):
+			if path is None or not os.path.isdir(path):
+				continue
+			parent,generation = os.path.split(path)
+			for name in os.listdir(parent):
+				# snapshots that other processes are still writing have a temporary name
+				if name!=generation and '.tmp-' not in name:
+					shutil.rmtree(os.path.join(parent,name),ignore_errors=True)
+
+	# Take the parsed data that can be reused from an older version of this course, given the names of the files that have changed since.
+	# The users and the attempt stores of unchanged SCORM packages are shared with the old course, since neither is changed once it's built.
+	# Returns the SCORM packages whose files have changed, or which are new.
+	def reuse(self,old,changed):
+		with old.lock:
+			old_data = old.__dict__.copy()
+		if self.user_filename==old.user_filename and self.user_filename not in changed and 'users' in old_data:
+			self.users = old_data['users']
+
+		changed_scorms = []
+		for scorm in self.scorms:
+			old_scorm = old.scorms_by_pk.get(scorm.pk)
+			if old_scorm is None or old_scorm.dat_filename!=scorm.dat_filename or scorm.dat_filename in changed:
+				changed_scorms.append(scorm)
+				continue
+			store = old_scorm.__dict__.get('store')
+			if store is not None:
+				# the old version's files are removed once this one has replaced it, so interactions that haven't been read yet come from this version's copy of the .dat file
+				storage,dat_filename = self.storage,scorm.dat_filename
+				store.read_interactions = lambda: read_interaction_records(storage,dat_filename)
+				scorm.load(store=store)
+		return changed_scorms
+
+	# Index the SCORM packages that each user has attempted. This loads every package.
+	def index_users(self):
+		self.load_scorms()
+		scorms_by_user = defaultdict(list)
+		for scorm in self.scorms:
+			for userid in scorm.attempts_by_user:
+				scorms_by_user[userid].append(scorm)
+		self.scorms_by_user = dict(scorms_by_user)
+
+	# Each SCORM package that the user has attempted, with their attempts at it.
+	def attempts_for_user(self,userid):
+		return [(scorm,scorm.attempts_for_user(userid)) for scorm in self.scorms_by_user.get(userid,[])]
+
+	def unload(self):
+		with self.lock:
+			for scorm in self.scorms:
+				scorm.unload()
+			for name in BlackboardCourse.lazy_attributes:
+				self.__dict__.pop(name,None)
 
 	def open_file(self,path):
-		return open(os.path.join(self.file_path,path),'rb').read()
+		with self.storage.open(path) as f:
+			return f.read()
 
-	def load_users(self):
-		user_filename = self.doc.xpath('//resource[@type="course/x-bb-user"]')[0].get('{http://www.blackboard.com/content-packaging/}file')
-		user_doc = etree.fromstring(self.open_file(user_filename))
+	def open_stream(self,path):
+		return self.storage.open(path)
 
-		self.users = {}
-		for element in user_doc.xpath('//USER'):
-			user = User(element)
-			self.users[user.id] = user
+	def file_size(self,path):
+		return self.storage.size(path)
+
+	# Nothing is read from the user file until a user is looked up.
+	def load_users(self):
+		self.users = CourseUsers(self.storage,self.user_filename)
 
 	def load_hierarchy(self):
 		organization = self.doc.xpath('//organization')[0]
@@ -249,19 +1220,17 @@ class BlackboardCourse(object):
 		if re.match(r'^placeholder/',title):
 			return self.load_item(element.xpath('item')[0])
 		ref = element.get('identifierref')
-		item_doc = etree.fromstring(self.open_file('{}.dat'.format(ref)))
+		with self.open_stream('{}.dat'.format(ref)) as f:
+			header = read_item_header(f)
 
-		item = HierarchyItem(title)
-		item.ref = ref
-		item.doc = etree.tostring(item_doc,pretty_print=True)
+		item = HierarchyItem(title,ref)
 
-		if item_doc.tag=='COURSETOC':
+		if header.tag=='COURSETOC':
 			item.kind = 'toc'
 			item.subitems = [self.load_item(subelement) for subelement in element.xpath('item/item')]
-		elif item_doc.tag=='CONTENT':
-			contenthandler = item_doc.xpath('//CONTENTHANDLER')
-			if len(contenthandler):
-				item.contenthandler = contenthandler[0].get('value')
+		elif header.tag=='CONTENT':
+			if header.contenthandler is not None:
+				item.contenthandler = header.contenthandler
 
 				content_kinds = {
 					'resource/x-plugin-scormengine': 'scorm',
@@ -270,49 +1239,278 @@ class BlackboardCourse(object):
 				item.kind = content_kinds.get(item.contenthandler,'other')
 
 				if item.contenthandler=='resource/x-plugin-scormengine':
-					content_id = item_doc.xpath('//CONTENT')[0].get('id')
-					item.scorm = self.load_scorm(content_id)
+					item.scorm = self.load_scorm(header.id)
 
 			item.subitems = [self.load_item(subelement) for subelement in element.xpath('item')]
 
 		return item
 
+	# The item in the hierarchy with the given ref, or None if there isn't one.
+	def find_item(self,ref):
+		items = list(self.items)
+		while items:
+			item = items.pop()
+			if item.ref==ref:
+				return item
+			items += item.subitems
+		return None
+
+	# The XML of one of the items in the hierarchy, pretty-printed.
+	def item_xml(self,ref):
+		return etree.tostring(etree.fromstring(self.open_file('{}.dat'.format(ref))),pretty_print=True)
+
 	def load_scorm(self,content_id):
-		resource = self.doc.xpath('//resource[@type="resource/x-plugin-scormengine" and @bb:title="'+content_id+'"]',namespaces={'bb':'http://www.blackboard.com/content-packaging/'})[0]
-		dat_filename = resource.get('{http://www.blackboard.com/content-packaging/}file')
-		
-		scorm_doc = etree.fromstring(self.open_file(dat_filename))
-		scorm = SCORM(self,scorm_doc)
+		dat_filename = self.resources.get('resource/x-plugin-scormengine',content_id).file
+		scorm = SCORM(self,dat_filename)
 		self.scorms_by_pk[scorm.pk] = scorm
 		self.scorms.append(scorm)
 		return scorm
 
+cache_root = 'cache'
+cache_version = 8
+
+# If none of the sizes or modification times of a course's source files have changed, neither has the parsed course.
+def source_signature(file_path):
+	return [cache_version,os.path.abspath(file_path)]+open_storage(file_path).signature()
+
+def path_key(file_path):
+	return hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+
+def cache_filename(file_path):
+	return os.path.join(cache_root,'{}.pickle'.format(path_key(file_path)))
+
+# A directory under root for data derived from the current version of a course's source files.
+# Each version of the course gets its own directory, next to the ones for older versions.
+def version_path(root,file_path):
+	generation = hashlib.sha1(json.dumps(source_signature(file_path)).encode('utf-8')).hexdigest()[:16]
+	return os.path.join(root,path_key(file_path),generation)
+
+# Remove the cached course, attempts and snapshots for a course's files, once nothing refers to them any more.
+def remove_derived_data(file_path):
+	try:
+		os.remove(cache_filename(file_path))
+	except FileNotFoundError:
+		pass
+	for root in (cache_root,snapshot_root):
+		shutil.rmtree(os.path.join(root,path_key(file_path)),ignore_errors=True)
+
+# Load a course from the parsed-course cache if its source files haven't changed since the cache was written, otherwise parse it and write a fresh cache file.
+# The cache only holds the course's structure. With cache_attempts=True, each SCORM package's attempts are saved in the attempt cache once they've been parsed, and loaded from there after that.
+def load_course(file_path,rebuild_cache=False,cache_attempts=True):
+	signature = source_signature(file_path)
+	filename = cache_filename(file_path)
+	attempt_cache = version_path(cache_root,file_path) if cache_attempts else None
+
+	if not rebuild_cache:
+		try:
+			with open(filename,'rb') as f, metrics.phase('cache',os.fstat(f.fileno()).st_size):
+				cached_signature,course = pickle.load(f)
+			if cached_signature==signature:
+				course.attempt_cache = attempt_cache
+				return course
+		except (OSError,EOFError,pickle.UnpicklingError,AttributeError):
+			pass
+
+	if attempt_cache is not None:
+		shutil.rmtree(attempt_cache,ignore_errors=True)
+	course = BlackboardCourse(file_path)
+	course.attempt_cache = attempt_cache
+
+	os.makedirs(cache_root,exist_ok=True)
+	tmp_filename = filename+'.tmp'
+	with open(tmp_filename,'wb') as f:
+		pickle.dump((signature,course),f,pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp_filename,filename)
+
+	return course
+
+snapshot_root = 'snapshots'
+
+# The directory for the snapshot of a course's attempts, for the current version of its source files.
+def snapshot_path(file_path):
+	return version_path(snapshot_root,file_path)
+
+# whether the current thread holds the snapshot lock
+snapshot_lock_held = threading.local()
+
+# Only one process at a time writes snapshots, so that when several server processes start at once, each course is only parsed once.
+# A thread that already holds the lock can take it again.
+@contextmanager
+def snapshot_lock():
+	if getattr(snapshot_lock_held,'held',False):
+		yield
+		return
+	import fcntl
+	os.makedirs(snapshot_root,exist_ok=True)
+	with open(os.path.join(snapshot_root,'.lock'),'w') as f:
+		fcntl.flock(f,fcntl.LOCK_EX)
+		snapshot_lock_held.held = True
+		try:
+			yield
+		finally:
+			snapshot_lock_held.held = False
+			fcntl.flock(f,fcntl.LOCK_UN)
+
+# With snapshots=True, attempts are loaded from memory-mapped snapshots which several server processes can share, and changes that another process makes to the state file are picked up by refresh.
 class State(object):
-	def __init__(self):
+	def __init__(self,rebuild_cache=False,memory_budget=1024*1024*1024,snapshots=False):
 		self.courses = []
 		self.courses_by_pk = {}
+		self.rebuild_cache = rebuild_cache
+		self.snapshots = snapshots
+
+		# caches of data derived from courses, keyed by course pk, which are cleared when a course is replaced
+		self.course_caches = []
+
+		# the courses that each username is in, which is built when it's first needed
+		self.courses_by_username = None
+
+		# courses whose data has been loaded, least recently used first
+		self.memory_budget = memory_budget
+		self.loaded_courses = OrderedDict()
+		self.lock = threading.Lock()
 
+		# the signature of each course's source files when it was loaded, keyed by path
+		self.signatures = {}
+		self.state_modified = None
+		self.refresh_lock = threading.Lock()
+		self.refresh()
+
+	# Load the courses in the state file which have been added or changed since it was last read.
+	def refresh(self):
 		try:
-			data = json.loads(open('state.json').read())
+			modified = os.stat('state.json').st_mtime_ns
 		except FileNotFoundError:
 			return
+		if modified==self.state_modified:
+			return
+		with self.refresh_lock:
+			if modified==self.state_modified:
+				return
+			for course in self.load_state_file():
+				# the state file already refers to this version of the course
+				course.remove_old_versions()
+			self.state_modified = modified
 
+	# Load the courses in the state file which have been added or changed since it was last read, and return them.
+	def load_state_file(self):
+		loaded = []
+		try:
+			with open('state.json') as f:
+				data = json.load(f)
+		except FileNotFoundError:
+			return loaded
 		for course_data in data.get('courses',[]):
-			course = BlackboardCourse(course_data['extract_path'])
+			# the 'extract_path' key is from before courses could be read straight from their zip files
+			path = course_data.get('path',course_data.get('extract_path'))
+			signature = source_signature(path)
+			if self.signatures.get(path)==signature:
+				continue
+			# the snapshots take the place of the attempt cache
+			course = load_course(path,self.rebuild_cache,cache_attempts=not self.snapshots)
+			if self.snapshots:
+				self.attach_snapshot(course)
+			self.signatures[path] = signature
 			self.add_course(course)
+			loaded.append(course)
+		return loaded
+
+	# Hold this while adding a course and saving the state file, and removing what the saved state no longer refers to.
+	# With snapshots, this is held by one server process at a time, and the courses that other processes have saved to the state file are loaded first, so they're not left out of the saved state.
+	@contextmanager
+	def updating(self):
+		if not self.snapshots:
+			yield
+			return
+		with snapshot_lock():
+			with self.refresh_lock:
+				self.load_state_file()
+			yield
 
+	# Load the course's attempts from its snapshot, writing the snapshot first if no other process has.
+	def attach_snapshot(self,course,workers=None):
+		path = snapshot_path(course.file_path)
+		with snapshot_lock():
+			if os.path.isdir(path):
+				course.snapshot = path
+				for scorm in course.scorms:
+					scorm.unload()
+			else:
+				course.publish_snapshot(path,workers)
+
+	# Add a course, or replace the course with the same pk.
+	# The list of courses is replaced rather than changed in place, so a request that's looking at it never sees it half-updated.
+	# A course that already has data loaded, as one that's just been ingested does, counts as the most recently used.
 	def add_course(self,course):
-		if course.pk in self.courses_by_pk:
-			i = [c.pk for c in self.courses].index(course.pk)
-			self.courses[i] = course
-		else:
-			self.courses.append(course)
-		self.courses_by_pk[course.pk] = course
+		evicted = []
+		with self.lock:
+			courses = [course if c.pk==course.pk else c for c in self.courses]
+			if course.pk not in self.courses_by_pk:
+				courses.append(course)
+			self.courses = courses
+			self.courses_by_pk[course.pk] = course
+			self.courses_by_username = None
+			self.loaded_courses.pop(course.pk,None)
+			for cache in self.course_caches:
+				cache.pop(course.pk,None)
+			if course.loaded_size:
+				self.loaded_courses[course.pk] = course
+				evicted = self.apply_memory_budget()
+		for c in evicted:
+			c.unload()
+
+	# Get a course, and mark it as the most recently used.
+	def use_course(self,pk):
+		course = self.courses_by_pk[pk]
+		with self.lock:
+			self.loaded_courses[pk] = course
+			self.loaded_courses.move_to_end(pk)
+			evicted = self.apply_memory_budget()
+		for c in evicted:
+			c.unload()
+		return course
+
+	# Note that a course's data has been loaded only to be looked at, as when finding a user's attempts in every course.
+	# Unless it's already been used, it counts as the least recently used course, so it doesn't push out the courses that have been.
+	def look_at_course(self,course):
+		with self.lock:
+			if self.courses_by_pk.get(course.pk) is course and course.pk not in self.loaded_courses:
+				self.loaded_courses[course.pk] = course
+				self.loaded_courses.move_to_end(course.pk,last=False)
+			evicted = self.apply_memory_budget()
+		for c in evicted:
+			c.unload()
+
+	# The courses that have a user with the given username.
+	def courses_for_username(self,username):
+		with self.lock:
+			if self.courses_by_username is None:
+				courses_by_username = defaultdict(list)
+				for course in self.courses:
+					for name in course.userids_by_username:
+						courses_by_username[name].append(course)
+				self.courses_by_username = dict(courses_by_username)
+			return self.courses_by_username.get(username,[])
+
+	# Take the least recently used courses out of the loaded courses until the ones that remain fit in the memory budget. The most recently used course is always kept.
+	# This must be called with self.lock held. It returns the courses that were taken out, which the caller unloads once it has released self.lock: unloading a course waits for any of its packages that are being parsed, and other requests shouldn't have to wait for that too.
+	def apply_memory_budget(self):
+		loaded_size = sum(c.loaded_size for c in self.loaded_courses.values())
+		evicted = []
+		while loaded_size>self.memory_budget and len(self.loaded_courses)>1:
+			_,course = self.loaded_courses.popitem(last=False)
+			loaded_size -= course.loaded_size
+			evicted.append(course)
+		return evicted
 
 	def save(self):
-		data = {
-			'courses': [{'extract_path': course.file_path} for course in self.courses]
-		}
-		f = open('state.json','w')
-		f.write(json.dumps(data))
-		f.close()
+		with self.lock:
+			data = {
+				'courses': [{'path': course.file_path} for course in self.courses]
+			}
+			f = open('state.json.tmp','w')
+			f.write(json.dumps(data))
+			f.close()
+			os.replace('state.json.tmp','state.json')
+			self.signatures = {course.file_path:source_signature(course.file_path) for course in self.courses}
+			self.state_modified = os.stat('state.json').st_mtime_ns
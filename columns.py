@@ -0,0 +1,119 @@
+# Compact column types for storing tables of attempt data, and a descriptor for reading them through lightweight view objects.
+
+import json
+import os
+import sys
+
+import numpy as np
+
+# A column of strings, stored as one block of UTF-8 bytes and an array of offsets into it.
+class StringColumn(object):
+	def __init__(self,strings):
+		encoded = [s.encode('utf-8') if s is not None else b'' for s in strings]
+		self.data = np.frombuffer(b''.join(encoded),dtype=np.uint8)
+		self.offsets = np.zeros(len(encoded)+1,dtype=np.int64)
+		np.cumsum([len(s) for s in encoded],out=self.offsets[1:])
+		self.nulls = np.array([s is None for s in strings],dtype=bool)
+
+	def __len__(self):
+		return len(self.nulls)
+
+	def __getitem__(self,i):
+		if self.nulls[i]:
+			return None
+		return self.data[self.offsets[i]:self.offsets[i+1]].tobytes().decode('utf-8')
+
+	@classmethod
+	def from_arrays(cls,data,offsets,nulls):
+		column = cls.__new__(cls)
+		column.data = data
+		column.offsets = offsets
+		column.nulls = nulls
+		return column
+
+	# Every string in the column, decoded in one go.
+	def tolist(self):
+		data = self.data.tobytes()
+		offsets = self.offsets.tolist()
+		return [None if null else data[start:end].decode('utf-8') for start,end,null in zip(offsets,offsets[1:],self.nulls.tolist())]
+
+	@property
+	def nbytes(self):
+		return self.data.nbytes+self.offsets.nbytes+self.nulls.nbytes
+
+# A column of values drawn from a small set, such as question ids, stored as an array of codes into a list of the distinct values.
+class CategoryColumn(object):
+	def __init__(self,values):
+		index = {}
+		self.codes = np.array([index.setdefault(value,len(index)) for value in values],dtype=np.int32)
+		self.values = list(index)
+
+	@classmethod
+	def from_arrays(cls,codes,values):
+		column = cls.__new__(cls)
+		column.codes = codes
+		column.values = values
+		return column
+
+	def __len__(self):
+		return len(self.codes)
+
+	def __getitem__(self,i):
+		return self.values[self.codes[i]]
+
+	# the distinct values are Python objects, so they're counted with sys.getsizeof
+	@property
+	def nbytes(self):
+		return self.codes.nbytes+sys.getsizeof(self.values)+sum(sys.getsizeof(value) for value in self.values)
+
+# Save the columns of a table to .npy files in a directory, so that they can be loaded again with load_columns. Other attributes of the table, and the columns named in skip, aren't saved.
+def save_columns(table,path,skip=()):
+	os.makedirs(path,exist_ok=True)
+	kinds = {}
+	for name,value in table.__dict__.items():
+		if name in skip:
+			continue
+		if isinstance(value,np.ndarray):
+			np.save(os.path.join(path,name+'.npy'),value)
+			kinds[name] = 'array'
+		elif isinstance(value,StringColumn):
+			for part in ('data','offsets','nulls'):
+				np.save(os.path.join(path,'{}.{}.npy'.format(name,part)),getattr(value,part))
+			kinds[name] = 'string'
+		elif isinstance(value,CategoryColumn):
+			np.save(os.path.join(path,name+'.codes.npy'),value.codes)
+			kinds[name] = {'values': value.values}
+	with open(os.path.join(path,'columns.json'),'w') as f:
+		json.dump(kinds,f)
+
+# Load the columns saved by save_columns into a table.
+# The arrays are memory-mapped, so they're only read from disk as they're used, and every process that loads the same files shares one copy of them.
+def load_columns(table,path):
+	def load(name):
+		return np.load(os.path.join(path,name+'.npy'),mmap_mode='r')
+
+	with open(os.path.join(path,'columns.json')) as f:
+		kinds = json.load(f)
+	for name,kind in kinds.items():
+		if kind=='array':
+			value = load(name)
+		elif kind=='string':
+			value = StringColumn.from_arrays(*(load('{}.{}'.format(name,part)) for part in ('data','offsets','nulls')))
+		else:
+			value = CategoryColumn.from_arrays(load(name+'.codes'),kind['values'])
+		setattr(table,name,value)
+	return table
+
+# An attribute of a view object, read from row view.row of the column of the same name in view.table.
+class column(object):
+	def __init__(self,convert=None):
+		self.convert = convert
+
+	def __set_name__(self,owner,name):
+		self.name = name
+
+	def __get__(self,view,owner=None):
+		if view is None:
+			return self
+		value = getattr(view.table,self.name)[view.row]
+		return self.convert(value) if self.convert else value
@@ -0,0 +1,354 @@
+# Export every course's users, attempts, objectives and interactions as Parquet files, for analysis with other tools.
+#
+#     python export.py --output exports
+#
+# Each table is a directory partitioned by course, like exports/attempts/course=<course pk>/scorm-<scorm pk>.parquet, so it can be read as one dataset with hive partitioning.
+# Courses whose source files haven't changed since they were last exported aren't written again.
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import traceback
+import zipfile
+from contextlib import contextmanager
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from blackboardscorm import State,source_signature,completion_statuses,success_statuses,interaction_types,parse_interaction_id
+
+export_version = 2
+
+# how many attempts or users go in each record batch
+batch_size = 1000
+
+tables = ('users','attempts','objectives','interactions')
+
+schemas = {
+	'users': pa.schema([
+		('userid',pa.string()),
+		('username',pa.string()),
+		('studentid',pa.string()),
+		('first_name',pa.string()),
+		('middle_name',pa.string()),
+		('last_name',pa.string()),
+		('fullname',pa.string()),
+		('email',pa.string()),
+	]),
+	'attempts': pa.schema([
+		('scorm_pk',pa.string()),
+		('scorm_title',pa.string()),
+		('attempt_pk',pa.string()),
+		('userid',pa.string()),
+		('number',pa.int32()),
+		('duration',pa.int64()),
+		('completion_status',pa.string()),
+		('success_status',pa.string()),
+		('scaled_score',pa.float64()),
+		('raw_score',pa.float64()),
+		('min_score',pa.float64()),
+		('max_score',pa.float64()),
+		('start_time',pa.timestamp('us')),
+		('location',pa.string()),
+		('total_time',pa.float64()),
+	]),
+	'objectives': pa.schema([
+		('scorm_pk',pa.string()),
+		('attempt_pk',pa.string()),
+		('id',pa.string()),
+		('name',pa.string()),
+		('question',pa.int32()),
+		('completion_status',pa.string()),
+		('success_status',pa.string()),
+		('progress_measure',pa.float64()),
+		('raw_score',pa.float64()),
+		('min_score',pa.float64()),
+		('max_score',pa.float64()),
+		('scaled_score',pa.float64()),
+	]),
+	'interactions': pa.schema([
+		('scorm_pk',pa.string()),
+		('attempt_pk',pa.string()),
+		('id',pa.string()),
+		('question',pa.int32()),
+		('part',pa.int32()),
+		('gap',pa.int32()),
+		('step',pa.int32()),
+		('part_type',pa.string()),
+		('interaction_type',pa.string()),
+		('learner_response',pa.string()),
+		('correct_response',pa.string()),
+		('max_score',pa.float64()),
+		('raw_score',pa.float64()),
+		('objective',pa.string()),
+	]),
+}
+
+def to_number(value):
+	try:
+		return float(value)
+	except (TypeError,ValueError):
+		return None
+
+def strings(column,start,stop):
+	return [column[i] for i in range(start,stop)]
+
+def categories(column,start,stop):
+	return [column.values[code] for code in column.codes[start:stop]]
+
+def names(labels,codes):
+	return np.array(labels,dtype=object)[codes].tolist()
+
+def user_batches(course):
+	users = list(course.users.values())
+	for start in range(0,len(users),batch_size):
+		batch = users[start:start+batch_size]
+		yield pa.record_batch([[getattr(user,name) for user in batch] for name in ('id','username','studentid','first_name','middle_name','last_name','fullname','email')],schema=schemas['users'])
+
+def attempt_batch(scorm,start,stop):
+	store = scorm.store
+	return pa.record_batch([
+		[scorm.pk]*(stop-start),
+		[scorm.title]*(stop-start),
+		strings(store.pk,start,stop),
+		categories(store.userid,start,stop),
+		store.number[start:stop],
+		store.duration[start:stop],
+		names(completion_statuses,store.completion_status[start:stop]),
+		names(success_statuses,store.success_status[start:stop]),
+		store.scaled_score[start:stop],
+		store.raw_score[start:stop],
+		store.min_score[start:stop],
+		store.max_score[start:stop],
+		pa.array(store.start_time[start:stop],pa.timestamp('us')),
+		strings(store.location,start,stop),
+		store.total_time[start:stop],
+	],schema=schemas['attempts'])
+
+# The pk of the attempt that each of rows offsets[start] to offsets[stop] of a child table belongs to.
+def attempt_pks(store,offsets,start,stop):
+	return np.repeat(np.array(strings(store.pk,start,stop),dtype=object),np.diff(offsets[start:stop+1])).tolist()
+
+def objective_batch(scorm,start,stop):
+	store = scorm.store
+	objectives = store.objectives
+	first,last = store.objective_start[start],store.objective_start[stop]
+	return pa.record_batch([
+		[scorm.pk]*(last-first),
+		attempt_pks(store,store.objective_start,start,stop),
+		categories(objectives.id,first,last),
+		categories(objectives.name,first,last),
+		objectives.question[first:last],
+		names(completion_statuses,objectives.completion_status[first:last]),
+		names(success_statuses,objectives.success_status[first:last]),
+		objectives.progress_measure[first:last],
+		objectives.raw_score[first:last],
+		objectives.min_score[first:last],
+		objectives.max_score[first:last],
+		objectives.scaled_score[first:last],
+	],schema=schemas['objectives'])
+
+def interaction_batch(scorm,start,stop):
+	store = scorm.store
+	interactions = store.interactions
+	first,last = store.interaction_start[start],store.interaction_start[stop]
+	ids = [parse_interaction_id(id) for id in categories(interactions.id,first,last)]
+	return pa.record_batch([
+		[scorm.pk]*(last-first),
+		attempt_pks(store,store.interaction_start,start,stop),
+		categories(interactions.id,first,last),
+		[id.question_number for id in ids],
+		[id.part for id in ids],
+		[id.gap for id in ids],
+		[id.step for id in ids],
+		categories(interactions.part_type,first,last),
+		names(interaction_types,interactions.interaction_type[first:last]),
+		strings(interactions.learner_response,first,last),
+		strings(interactions.correct_response,first,last),
+		[to_number(v) for v in categories(interactions.max_score,first,last)],
+		[to_number(v) for v in categories(interactions.raw_score,first,last)],
+		categories(interactions.objective,first,last),
+	],schema=schemas['interactions'])
+
+scorm_batches = {
+	'attempts': attempt_batch,
+	'objectives': objective_batch,
+	'interactions': interaction_batch,
+}
+
+def write_batches(path,schema,batches):
+	os.makedirs(os.path.dirname(path),exist_ok=True)
+	with pq.ParquetWriter(path,schema) as writer:
+		for batch in batches:
+			writer.write_batch(batch)
+
+# Write one course's tables into the directory path, one SCORM package at a time.
+# Packages which weren't already loaded are unloaded again once they've been written, so only one package's attempts are held in memory.
+def write_course(course,path):
+	partition = 'course={}'.format(course.pk)
+	write_batches(os.path.join(path,'users',partition,'users.parquet'),schemas['users'],user_batches(course))
+
+	for scorm in course.scorms:
+		was_loaded = scorm.loaded
+		for table,make_batch in scorm_batches.items():
+			filename = os.path.join(path,table,partition,'scorm-{}.parquet'.format(scorm.pk))
+			write_batches(filename,schemas[table],(make_batch(scorm,start,min(start+batch_size,scorm.num_attempts)) for start in range(0,scorm.num_attempts,batch_size)))
+		if not was_loaded:
+			scorm.unload()
+
+def read_manifest(output):
+	try:
+		with open(os.path.join(output,'manifest.json')) as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return {}
+
+def write_manifest(output,manifest):
+	filename = os.path.join(output,'manifest.json')
+	with open(filename+'.tmp','w') as f:
+		json.dump(manifest,f)
+	os.replace(filename+'.tmp',filename)
+
+# Export every course in the state to the output directory, skipping courses which haven't changed since they were last exported.
+# Each course is written to a temporary directory first, and then its partitions are swapped in.
+# Returns the pks of the courses that were written.
+def export_state(state,output,progress=None):
+	os.makedirs(output,exist_ok=True)
+	manifest = read_manifest(output)
+	written = []
+
+	for course in state.courses:
+		# round-tripped through JSON so it compares equal to the copy in the manifest
+		signature = json.loads(json.dumps([export_version]+source_signature(course.file_path)))
+		partition = 'course={}'.format(course.pk)
+		if manifest.get(course.pk)==signature and all(os.path.exists(os.path.join(output,table,partition)) for table in tables):
+			continue
+
+		if progress:
+			progress(course)
+		course = state.use_course(course.pk)
+		tmp_path = os.path.join(output,'.tmp-{}'.format(course.pk))
+		shutil.rmtree(tmp_path,ignore_errors=True)
+		write_course(course,tmp_path)
+
+		for table in tables:
+			target = os.path.join(output,table,partition)
+			shutil.rmtree(target,ignore_errors=True)
+			os.makedirs(os.path.dirname(target),exist_ok=True)
+			os.replace(os.path.join(tmp_path,table,partition),target)
+		shutil.rmtree(tmp_path)
+
+		manifest[course.pk] = signature
+		write_manifest(output,manifest)
+		written.append(course.pk)
+
+	return written
+
+# The signatures of every course's source files, which a zip file of the export is labelled with, so that it's only made again once a course has changed.
+def state_signature(state):
+	# round-tripped through JSON so it compares equal to the saved copy
+	return json.loads(json.dumps([[course.pk,export_version]+source_signature(course.file_path) for course in state.courses]))
+
+# Zip up the exported tables in output, labelled with the given signature.
+# The zip file is written to a temporary name and then moved into place, so a download that's already started isn't affected.
+def write_zip(output,zip_path,signature):
+	tmp_path = '{}.tmp-{}'.format(zip_path,os.getpid())
+	with zipfile.ZipFile(tmp_path,'w') as z:
+		for root,dirs,files in os.walk(output):
+			dirs[:] = [d for d in dirs if not d.startswith('.')]
+			for name in files:
+				path = os.path.join(root,name)
+				z.write(path,os.path.relpath(path,output))
+	os.replace(tmp_path,zip_path)
+	with open(zip_path+'.json.tmp','w') as f:
+		json.dump(signature,f)
+	os.replace(zip_path+'.json.tmp',zip_path+'.json')
+
+# Whether the zip file is an export of the current version of every course.
+def zip_up_to_date(state,zip_path):
+	try:
+		with open(zip_path+'.json') as f:
+			signature = json.load(f)
+	except (OSError,ValueError):
+		return False
+	return os.path.exists(zip_path) and signature==state_signature(state)
+
+# Only one process at a time writes an export.
+@contextmanager
+def export_file_lock(output):
+	import fcntl
+	with open(output+'.lock','w') as f:
+		fcntl.flock(f,fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(f,fcntl.LOCK_UN)
+
+# Export the state and zip it up in a background thread, since exporting every course can take much longer than a proxy will wait for a response.
+# Only one export runs at a time. When several server processes start an export at once, the ones that have to wait find that the zip is already up to date.
+class BackgroundExport(object):
+	def __init__(self,state,output,zip_path):
+		self.state = state
+		self.output = output
+		self.zip_path = zip_path
+		self.phase = None
+		self.error = None
+		# the title of the course being exported
+		self.course = None
+		self.lock = threading.Lock()
+
+	@property
+	def running(self):
+		return self.phase in ('queued','exporting','zipping')
+
+	# Start an export, unless one is already running.
+	def start(self):
+		with self.lock:
+			if self.running:
+				return
+			self.phase = 'queued'
+			self.error = None
+			self.course = None
+		threading.Thread(target=self.run,daemon=True).start()
+
+	def run(self):
+		try:
+			with export_file_lock(self.output):
+				if not self.ready():
+					self.phase = 'exporting'
+					signature = state_signature(self.state)
+					export_state(self.state,self.output,progress=self.course_started)
+					self.phase = 'zipping'
+					write_zip(self.output,self.zip_path,signature)
+			self.phase = 'done'
+		except Exception as e:
+			traceback.print_exc()
+			self.phase = 'failed'
+			self.error = str(e)
+
+	def course_started(self,course):
+		self.course = course.title
+
+	def ready(self):
+		return zip_up_to_date(self.state,self.zip_path)
+
+	def status(self):
+		return {
+			'phase': self.phase,
+			'error': self.error,
+			'course': self.course,
+			'ready': self.ready(),
+		}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Export every course\'s data as Parquet files')
+	parser.add_argument('--output',default='exports',help='The directory to write the tables to')
+	parser.add_argument('--memory-budget',type=int,default=1024,help='Roughly how many megabytes of course data to keep loaded at once')
+	args = parser.parse_args()
+
+	state = State(memory_budget=args.memory_budget*1024*1024)
+	written = export_state(state,args.output,progress=lambda course: print('Exporting {}'.format(course.title)))
+	print('Exported {} of {} courses to {}'.format(len(written),len(state.courses),args.output))
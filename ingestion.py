@@ -0,0 +1,296 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import traceback
+import uuid
+import zipfile
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from blackboardscorm import load_course, remove_derived_data
+from assets import build_manifest, manifest_filename
+
+uuid_pattern = re.compile(r'[0-9a-f]{32}')
+
+def remove_file(path):
+	try:
+		os.remove(path)
+	except FileNotFoundError:
+		pass
+
+# The CRC-32 and size of each file in a zip file. The zip file's directory records these, so nothing needs to be decompressed to get them.
+def zip_digests(path):
+	with zipfile.ZipFile(path) as zip:
+		return {info.filename:(info.CRC,info.file_size) for info in zip.infolist() if not info.is_dir()}
+
+# Remove a version of a course's files, and everything derived from it.
+def remove_version(path):
+	if os.path.isdir(path):
+		shutil.rmtree(path,ignore_errors=True)
+	else:
+		remove_file(path)
+	remove_derived_data(path)
+	remove_file(manifest_filename(path))
+
+# Link a file into a new version of a course, or copy it if the filesystem doesn't support hard links.
+# Files are never changed in place, so the versions can share them.
+def link_file(source,target):
+	os.makedirs(os.path.dirname(target),exist_ok=True)
+	try:
+		os.link(source,target)
+	except OSError:
+		shutil.copy2(source,target)
+
+def file_digest(path):
+	crc = 0
+	with open(path,'rb') as f:
+		for chunk in iter(lambda: f.read(1024*1024),b''):
+			crc = zlib.crc32(chunk,crc)
+	return (crc,os.path.getsize(path))
+
+class IngestionJob(object):
+	def __init__(self,name,upload_path,status_path=None):
+		self.id = uuid.uuid4().hex
+		self.name = name
+		self.upload_path = upload_path
+		# if given, the job's status is written to this file whenever it changes, so other server processes can report it
+		self.status_path = status_path
+		self.phase = 'queued'
+		self.error = None
+		self.course_pk = None
+
+		self.created = time.time()
+		self.phase_started = None
+		self.finished = None
+
+		# progress through the current phase
+		self.bytes_total = 0
+		self.bytes_done = 0
+		self.scorms_total = 0
+		self.scorms_done = 0
+		# SCORM packages whose files hadn't changed since the course was last uploaded
+		self.scorms_reused = 0
+
+		# totals for the whole job, which are kept once their phase has finished
+		self.upload_bytes = 0
+		self.load_bytes_total = 0
+		self.load_bytes_done = 0
+
+	def start_phase(self,phase,bytes_total=0):
+		self.phase = phase
+		self.phase_started = time.time()
+		self.bytes_total = bytes_total
+		self.bytes_done = 0
+		self.save_status()
+
+	def scorm_loaded(self,scorm):
+		self.scorms_done += 1
+		self.bytes_done += scorm.size
+		self.load_bytes_done += scorm.size
+		self.save_status()
+
+	def save_status(self):
+		if self.status_path is None:
+			return
+		with open(self.status_path+'.tmp','w') as f:
+			json.dump(self.status(),f)
+		os.replace(self.status_path+'.tmp',self.status_path)
+
+	# Estimate the seconds left in the current phase, from how fast it's got through the bytes so far.
+	@property
+	def eta(self):
+		if not (self.bytes_done and self.bytes_total):
+			return None
+		elapsed = time.time()-self.phase_started
+		return elapsed*(self.bytes_total-self.bytes_done)/self.bytes_done
+
+	def status(self):
+		return {
+			'id': self.id,
+			'name': self.name,
+			'phase': self.phase,
+			'error': self.error,
+			'course': self.course_pk,
+			'bytes_total': self.bytes_total,
+			'bytes_done': self.bytes_done,
+			'scorms_total': self.scorms_total,
+			'scorms_done': self.scorms_done,
+			'scorms_reused': self.scorms_reused,
+			'upload_bytes': self.upload_bytes,
+			'load_bytes_total': self.load_bytes_total,
+			'load_bytes_done': self.load_bytes_done,
+			'eta': self.eta,
+			'elapsed': (self.finished or time.time())-self.created,
+		}
+
+# Uploaded archives are ingested by a pool of background threads.
+# A course is only swapped into the state once it's finished loading, and uploads of the same course are ingested one at a time.
+# Each upload is stored as a new version of the course, next to the one that's being served, which is only removed once the state file refers to the new one. If an upload fails, the course that's being served is left as it was.
+# If status_root is given, each job's status is written to a file in that directory, so that any server process can report it.
+class IngestionQueue(object):
+	def __init__(self,state,extract_root,workers=2,parse_workers=None,extract=False,status_root=None):
+		self.state = state
+		self.extract_root = extract_root
+		self.status_root = status_root
+		self.parse_workers = parse_workers
+		self.extract = extract
+		self.executor = ThreadPoolExecutor(max_workers=workers)
+		self.jobs = {}
+		self.course_locks = defaultdict(threading.Lock)
+		self.lock = threading.Lock()
+
+	def submit(self,name,upload_path):
+		job = IngestionJob(name,upload_path)
+		if self.status_root is not None:
+			os.makedirs(self.status_root,exist_ok=True)
+			job.status_path = os.path.join(self.status_root,job.id+'.json')
+		self.jobs[job.id] = job
+		job.save_status()
+		self.executor.submit(self.run,job)
+		return job
+
+	# The status of a job, which might belong to another server process, or None if there's no such job.
+	def status(self,id):
+		if id in self.jobs:
+			return self.jobs[id].status()
+		if self.status_root is not None and uuid_pattern.fullmatch(id):
+			try:
+				with open(os.path.join(self.status_root,id+'.json')) as f:
+					return json.load(f)
+			except FileNotFoundError:
+				pass
+		return None
+
+	def run(self,job):
+		with self.lock:
+			course_lock = self.course_locks[job.name]
+		course_path = None
+		try:
+			with course_lock:
+				old_course = self.current_version(job.name)
+				course_path,changed = self.store(job,old_course)
+
+				job.start_phase('parsing')
+				course = load_course(course_path,rebuild_cache=True,cache_attempts=not self.state.snapshots)
+				scorms = course.scorms
+				if changed is not None:
+					scorms = course.reuse(old_course,changed)
+					job.scorms_reused = len(course.scorms)-len(scorms)
+
+				job.load_bytes_total = sum(scorm.size for scorm in scorms)
+				job.start_phase('loading',job.load_bytes_total)
+				job.scorms_total = len(scorms)
+				course.load_scorms(self.parse_workers,progress=job.scorm_loaded,scorms=scorms)
+
+				job.start_phase('assets')
+				build_manifest(course)
+
+				job.start_phase('saving')
+				if self.state.snapshots:
+					self.state.attach_snapshot(course,self.parse_workers)
+				with self.state.updating():
+					self.state.add_course(course)
+					self.state.save()
+					course.remove_old_versions()
+					# the old version is kept if it's still in the state as a different course
+					if old_course is not None and self.state.courses_by_pk.get(old_course.pk) is not old_course:
+						remove_version(old_course.file_path)
+				job.course_pk = course.pk
+				job.phase = 'done'
+		except Exception as e:
+			traceback.print_exc()
+			job.phase = 'failed'
+			job.error = str(e)
+			shutil.rmtree(self.version_path(job)+'.extracting',ignore_errors=True)
+			if course_path is not None and not any(c.file_path==course_path for c in self.state.courses):
+				remove_version(course_path)
+		finally:
+			remove_file(job.upload_path)
+			job.finished = time.time()
+			job.save_status()
+
+	# The course that was stored from the last upload with the given name, or None if there isn't one.
+	def current_version(self,name):
+		root = os.path.abspath(self.extract_root)
+		# courses uploaded before each upload was stored as a new version are at <name>.zip or <name>
+		pattern = re.compile(re.escape(name)+r'(\.[0-9a-f]{32})?(\.zip)?')
+		for course in self.state.courses:
+			path = os.path.abspath(course.file_path)
+			if os.path.dirname(path)==root and pattern.fullmatch(os.path.basename(path)):
+				return course
+		return None
+
+	# Where the version of the course uploaded by the job is stored, without the .zip extension that it has unless it's extracted.
+	def version_path(self,job):
+		return os.path.join(self.extract_root,'{}.{}'.format(job.name,job.id))
+
+	# Store the uploaded zip file as a new version of the course, at a path named after the job.
+	# Returns that path, and the names of the files which have changed since the old version, or None if the old version can't be compared with.
+	def store(self,job,old_course):
+		if not zipfile.is_zipfile(job.upload_path):
+			raise ValueError("The uploaded file isn't a zip file.")
+		job.upload_bytes = os.path.getsize(job.upload_path)
+		old_path = old_course.file_path if old_course is not None else None
+		extract_path = self.version_path(job)
+		digests = zip_digests(job.upload_path)
+		if self.extract:
+			if old_path is not None and os.path.isdir(old_path):
+				changed = self.update_extracted(job,old_path,extract_path,digests)
+			else:
+				changed = None
+				self.extract_all(job,extract_path)
+			return extract_path,changed
+		else:
+			zip_path = extract_path+'.zip'
+			changed = None
+			if old_path is not None and zipfile.is_zipfile(old_path):
+				old_digests = zip_digests(old_path)
+				changed = {name for name,digest in digests.items() if old_digests.get(name)!=digest}
+			os.replace(job.upload_path,zip_path)
+			return zip_path,changed
+
+	def extract_all(self,job,extract_path):
+		with zipfile.ZipFile(job.upload_path) as zip:
+			members = zip.infolist()
+			job.start_phase('extracting',sum(member.file_size for member in members))
+			tmp_path = extract_path+'.extracting'
+			shutil.rmtree(tmp_path,ignore_errors=True)
+			for member in members:
+				zip.extract(member,tmp_path)
+				job.bytes_done += member.file_size
+		os.replace(tmp_path,extract_path)
+
+	# Extract a new version of a course from the uploaded zip file, starting from the old version: only the files that differ from the old version's are extracted, and the rest are linked to the old version's files.
+	def update_extracted(self,job,old_path,extract_path,digests):
+		existing = set()
+		for root,dirs,files in os.walk(old_path):
+			for name in files:
+				existing.add(os.path.relpath(os.path.join(root,name),old_path).replace(os.sep,'/'))
+
+		changed = set()
+		for name,(crc,size) in digests.items():
+			if os.path.isabs(name) or '..' in name.split('/'):
+				raise ValueError('The zip file contains a file outside of the course: {}'.format(name))
+			path = os.path.join(old_path,name)
+			if name not in existing or os.path.getsize(path)!=size or file_digest(path)!=(crc,size):
+				changed.add(name)
+
+		tmp_path = extract_path+'.extracting'
+		shutil.rmtree(tmp_path,ignore_errors=True)
+		for name in set(digests)-changed:
+			link_file(os.path.join(old_path,name),os.path.join(tmp_path,name))
+		with zipfile.ZipFile(job.upload_path) as zip:
+			job.start_phase('extracting',sum(digests[name][1] for name in changed))
+			for name in changed:
+				path = os.path.join(tmp_path,name)
+				os.makedirs(os.path.dirname(path),exist_ok=True)
+				with zip.open(name) as source, open(path,'wb') as target:
+					shutil.copyfileobj(source,target)
+				job.bytes_done += digests[name][1]
+		os.replace(tmp_path,extract_path)
+
+		return changed|(existing-set(digests))
@@ -0,0 +1,149 @@
+# Timings of the phases of loading a course, and of the server's requests, which can be read in the Prometheus text format.
+# Each process keeps its own figures, so when the server runs with several worker processes, each one reports only the requests and loads it handled.
+#
+# To profile loading a single course with cProfile, run
+#
+#     python metrics.py --profile load.prof path/to/course
+#
+# and look at the result with a tool like snakeviz, or python -m pstats load.prof.
+
+import argparse
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+# upper bounds, in seconds, of the histogram buckets
+buckets = (0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,120,300)
+
+lock = threading.Lock()
+
+class Histogram(object):
+	def __init__(self):
+		self.counts = [0]*(len(buckets)+1)
+		self.count = 0
+		self.sum = 0
+
+	def observe(self,value):
+		self.counts[bisect_left(buckets,value)] += 1
+		self.count += 1
+		self.sum += value
+
+	# Lines of the exposition format for this histogram, with cumulative counts for each bucket.
+	def samples(self,name,labels):
+		total = 0
+		for bound,count in zip(buckets+('+Inf',),self.counts):
+			total += count
+			yield sample(name+'_bucket',dict(labels,le=bound),total)
+		yield sample(name+'_sum',labels,self.sum)
+		yield sample(name+'_count',labels,self.count)
+
+# time spent in each phase of loading courses, keyed by phase
+load_seconds = defaultdict(Histogram)
+# bytes of files parsed in each phase
+load_bytes = defaultdict(int)
+# rows read into each table: attempts, objectives, interactions and users
+load_rows = defaultdict(int)
+
+# time taken to respond to requests, keyed by (endpoint, method)
+request_seconds = defaultdict(Histogram)
+# number of responses, keyed by (endpoint, status code)
+responses = defaultdict(int)
+
+def record_phase(name,seconds,size=0):
+	with lock:
+		load_seconds[name].observe(seconds)
+		if size:
+			load_bytes[name] += size
+
+# Time the body of a with statement as a phase of loading, which parses size bytes.
+@contextmanager
+def phase(name,size=0):
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		record_phase(name,time.perf_counter()-start,size)
+
+def count_rows(table,count):
+	with lock:
+		load_rows[table] += count
+
+def record_request(endpoint,method,status,seconds):
+	with lock:
+		request_seconds[endpoint,method].observe(seconds)
+		responses[endpoint,status] += 1
+
+# Call a function and return its result along with how long it took. This is used to time functions run in worker processes, whose own figures would be lost.
+def timed_call(fn,*args):
+	start = time.perf_counter()
+	result = fn(*args)
+	return result,time.perf_counter()-start
+
+def escape(value):
+	return str(value).replace('\\','\\\\').replace('\n','\\n').replace('"','\\"')
+
+def sample(name,labels,value):
+	if labels:
+		name += '{'+','.join('{}="{}"'.format(key,escape(label)) for key,label in labels.items())+'}'
+	return '{} {}'.format(name,value)
+
+def metric(name,kind,help,lines):
+	yield '# HELP {} {}'.format(name,help)
+	yield '# TYPE {} {}'.format(name,kind)
+	yield from lines
+
+# Every metric, in the Prometheus text exposition format.
+def render():
+	with lock:
+		lines = [
+			metric('scorm_load_phase_seconds','histogram','Time spent in each phase of loading courses',
+				(line for name,histogram in sorted(load_seconds.items()) for line in histogram.samples('scorm_load_phase_seconds',{'phase':name}))),
+			metric('scorm_load_parsed_bytes_total','counter','Bytes of files parsed in each phase of loading courses',
+				(sample('scorm_load_parsed_bytes_total',{'phase':name},size) for name,size in sorted(load_bytes.items()))),
+			metric('scorm_load_rows_total','counter','Rows read into each table while loading courses',
+				(sample('scorm_load_rows_total',{'table':table},count) for table,count in sorted(load_rows.items()))),
+			metric('scorm_http_request_duration_seconds','histogram','Time taken to respond to requests, including streaming the body',
+				(line for (endpoint,method),histogram in sorted(request_seconds.items()) for line in histogram.samples('scorm_http_request_duration_seconds',{'endpoint':endpoint,'method':method}))),
+			metric('scorm_http_responses_total','counter','Responses to requests, by status code',
+				(sample('scorm_http_responses_total',{'endpoint':endpoint,'status':status},count) for (endpoint,status),count in sorted(responses.items()))),
+		]
+		return ''.join(line+'\n' for group in lines for line in group)
+
+# Load a course from scratch, reading every SCORM package's attempts and interactions, and the users who made them, in this process.
+def load_everything(path):
+	from blackboardscorm import BlackboardCourse
+	course = BlackboardCourse(path)
+	course.load_scorms(workers=1)
+	course.users.resolve()
+	for scorm in course.scorms:
+		scorm.store.interactions
+	return course
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Time each phase of loading a course, without using the cache')
+	parser.add_argument('path',help='The course\'s zip file or extracted directory')
+	parser.add_argument('--profile',help='Write cProfile statistics for the load to this file')
+	args = parser.parse_args()
+
+	# the figures are recorded in the copy of this module that blackboardscorm imports, rather than in this script.
+	# Importing them here also keeps the imports out of the profile.
+	import metrics
+	import blackboardscorm
+
+	if args.profile:
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.runcall(load_everything,args.path)
+		profiler.dump_stats(args.profile)
+	else:
+		load_everything(args.path)
+
+	print('{:<20} {:>6} {:>10} {:>12}'.format('phase','count','seconds','MB parsed'))
+	for name,histogram in sorted(metrics.load_seconds.items(),key=lambda item: -item[1].sum):
+		print('{:<20} {:>6} {:>10.3f} {:>12.1f}'.format(name,histogram.count,histogram.sum,metrics.load_bytes[name]/1e6))
+	for table,count in sorted(metrics.load_rows.items()):
+		print('{} {}'.format(count,table))
+	if args.profile:
+		print('Profile written to {}'.format(args.profile))
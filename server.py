@@ -1,34 +1,123 @@
-from flask import Flask, request, redirect, url_for, render_template, send_from_directory, Response
+from flask import Flask, g, request, redirect, url_for, render_template, send_file, send_from_directory, abort, jsonify, stream_with_context, Response
 from werkzeug.routing import BaseConverter
 from functools import wraps
 import os
-import shutil
+import argparse
+import shlex
 import json
-import zipfile
+import hashlib
+import hmac
 from lxml import etree
-from datetime import datetime,date,timedelta
-from blackboardscorm import State,BlackboardCourse
+from blackboardscorm import State,ZipStorage,Interaction,BoundedCache,attempt_sort_keys
+from ingestion import IngestionQueue
+from export import BackgroundExport
+from analysis import ItemAnalysis
+from assets import course_manifest,asset_path,choose_encoding
+import metrics
+import io
+import mimetypes
 import tempfile
+import threading
+import time
 import csv
-import itertools
 import pygal
 
 app = Flask(__name__)
 
 extract_root = 'courses'
-state = State()
+export_root = 'exports'
+parser = argparse.ArgumentParser(description='Blackboard SCORM analysis server',allow_abbrev=False)
+parser.add_argument('--rebuild-cache',action='store_true',help='Reparse every course instead of loading it from the cache')
+parser.add_argument('--memory-budget',type=int,default=1024,help='Roughly how many megabytes of course data to keep loaded at once')
+parser.add_argument('--extract-uploads',action='store_true',help='Extract uploaded archives to disk, instead of reading course files straight out of the zip file')
+parser.add_argument('--parse-workers',type=int,default=None,help='How many processes to use to parse a course\'s SCORM packages. Defaults to the number of CPUs.')
+parser.add_argument('--ingest-workers',type=int,default=2,help='How many uploaded archives can be ingested at the same time')
+parser.add_argument('--metrics-token',default=None,help='Serve load and request metrics at /metrics to requests which give this token in an "Authorization: Bearer" header')
+parser.add_argument('--snapshots',action='store_true',help='Load attempts from memory-mapped snapshots shared between server processes, as when running under a WSGI server with several workers')
+# Under a WSGI server the command line belongs to the WSGI server, so the options are read from the SCORM_ANALYSIS_OPTIONS environment variable instead.
+if __name__ == '__main__':
+	args = parser.parse_args()
+else:
+	args = parser.parse_args(shlex.split(os.environ.get('SCORM_ANALYSIS_OPTIONS','')))
+
+state = State(rebuild_cache=args.rebuild_cache,memory_budget=args.memory_budget*1024*1024,snapshots=args.snapshots)
+
+# rendered charts, keyed by course pk and then by (scorm pk, kind of chart, width, height)
+chart_cache = {}
+state.course_caches.append(chart_cache)
+
+# item analyses of SCORM packages, keyed by course pk and then by scorm pk
+analysis_cache = {}
+state.course_caches.append(analysis_cache)
+
+# serialized SCORM runtime data for reviewing attempts, keyed by course pk and then by (scorm pk, attempt pk), keeping the most recently used for each course
+cmi_cache = {}
+cmi_cache_size = 256
+state.course_caches.append(cmi_cache)
+
+# manifests of the files in each course's SCORM packages, keyed by course pk
+asset_cache = {}
+state.course_caches.append(asset_cache)
+asset_lock = threading.Lock()
+
+ingestion = IngestionQueue(state,extract_root,workers=args.ingest_workers,parse_workers=args.parse_workers,extract=args.extract_uploads,status_root='jobs' if args.snapshots else None)
+exporter = BackgroundExport(state,export_root,export_root+'.zip')
 print("Ready")
 
+## request timing
+
+@app.before_request
+def start_request_timer():
+	g.request_start = time.perf_counter()
+
+# The time is recorded once the response has been closed, so it includes streaming the body.
+@app.after_request
+def record_request_time(response):
+	start,endpoint,method = g.request_start,request.endpoint or 'none',request.method
+	response.call_on_close(lambda: metrics.record_request(endpoint,method,response.status_code,time.perf_counter()-start))
+	return response
+
+# Other server processes might have changed the set of courses
+if args.snapshots:
+	@app.before_request
+	def refresh_state():
+		state.refresh()
+
 ## view decorator
 def with_course(fn):
 	@wraps(fn)
 	def inner(*args,**kwargs):
-		course = kwargs['course'] = state.courses_by_pk[kwargs['course']]
+		course = kwargs['course'] = state.use_course(kwargs['course'])
 		if 'scorm' in kwargs:
 			kwargs['scorm'] = course.scorms_by_pk[kwargs['scorm']]
 		return fn(*args,**kwargs)
 	return inner
 
+## conditional responses
+
+# A response which the browser can revalidate: the body is only made if the browser's copy doesn't match the etag and modification time.
+def conditional_response(etag,last_modified,mimetype,make_body):
+	response = Response(mimetype=mimetype)
+	response.set_etag(etag)
+	response.last_modified = last_modified
+	response.cache_control.no_cache = True
+	response.make_conditional(request)
+	if response.status_code!=304:
+		response.set_data(make_body())
+	return response
+
+def chart_response(course,scorm,kind,render,width=800,height=250):
+	key = (scorm.pk,kind,width,height)
+	etag = hashlib.sha1(repr((course.file_path,course.modified.timestamp())+key).encode('utf-8')).hexdigest()
+
+	def make_body():
+		cache = chart_cache.setdefault(course.pk,{})
+		if key not in cache:
+			cache[key] = render(width,height)
+		return cache[key]
+
+	return conditional_response(etag,course.modified,'image/svg+xml',make_body)
+
 ## template filters
 
 @app.template_filter('pluralize')
@@ -68,29 +157,63 @@ def allowed_file(filename):
 
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_zip():
-	global state
 	file = None
 	if request.method == 'POST':
 		file = request.files['file']
 		if file and allowed_file(file.filename):
 			name,_ = os.path.splitext(file.filename)
-			zip = zipfile.ZipFile(file.stream)
-			extract_path = os.path.join(extract_root,name)
-			try:
-				shutil.rmtree(extract_path)
-			except FileNotFoundError:
-				pass
-			zip.extractall(extract_path)
-			course = BlackboardCourse(extract_path)
-			state.add_course(course)
-			state.save()
-			return redirect(url_for('course_index',course=course.pk))
+			os.makedirs(extract_root,exist_ok=True)
+			fd,upload_path = tempfile.mkstemp(suffix='.upload',dir=extract_root)
+			with os.fdopen(fd,'wb') as f:
+				file.save(f)
+			job = ingestion.submit(name,upload_path)
+			return redirect(url_for('upload_progress',job=job.id))
 
 	return render_template('upload.html')
 
+@app.route('/upload/<job>')
+def upload_progress(job):
+	status = ingestion.status(job)
+	if status is None:
+		abort(404)
+	return render_template('upload_progress.html',job=status)
+
+@app.route('/upload/<job>/status.json')
+def upload_status(job):
+	status = ingestion.status(job)
+	if status is None:
+		abort(404)
+	if status['course']:
+		status['url'] = url_for('course_index',course=status['course'])
+	return jsonify(status)
+
+# Download every course's data as Parquet tables in a zip file.
+# If the zip file isn't up to date, an export is started in the background, and a page showing its progress is returned. Only courses which have changed since the last export are written again.
+@app.route('/export.zip')
+def export_zip():
+	if exporter.ready():
+		return send_file(os.path.abspath(exporter.zip_path),mimetype='application/zip',as_attachment=True,download_name='scorm-export.zip')
+	exporter.start()
+	return render_template('export_progress.html'),202
+
+@app.route('/export/status.json')
+def export_status():
+	return jsonify(exporter.status())
+
+# Load and request timings in the Prometheus text format.
+# They're only served when a token has been set with --metrics-token, to requests that give it.
+@app.route('/metrics')
+def metrics_endpoint():
+	if args.metrics_token is None:
+		abort(404)
+	if not hmac.compare_digest(request.headers.get('Authorization',''),'Bearer '+args.metrics_token):
+		abort(403)
+	return Response(metrics.render(),mimetype='text/plain; version=0.0.4')
+
 @app.route('/course/<course>')
 @with_course
 def course_index(course):
+	course.load_scorms(args.parse_workers)
 	if len(course.scorms):
 		max_attempts = max(scorm.num_attempts for scorm in course.scorms)
 		min_attempts = min(scorm.num_attempts for scorm in course.scorms)
@@ -99,22 +222,89 @@ def course_index(course):
 		min_attempts = 0
 	return render_template('course/index.html',course=course,max_attempts=max_attempts,min_attempts=min_attempts,attempts_range=max(max_attempts-min_attempts,1))
 
+# Every attempt by one student at the course's SCORM packages, and with all_courses=1, at the packages in every other course they're enrolled on, matched by username.
+@app.route('/course/<course>/user/<user>')
+@with_course
+def view_user(course,user):
+	course.load_scorms(args.parse_workers)
+	# a student who made attempts but has since left the course isn't in its list of users
+	if user not in course.users and user not in course.scorms_by_user:
+		abort(404)
+	user = course.users.user(user)
+	all_courses = bool(request.args.get('all_courses'))
+
+	courses = [(course,course.attempts_for_user(user.id))]
+	if all_courses and not user.missing:
+		for other in state.courses_for_username(user.username):
+			if other.pk==course.pk:
+				continue
+			other.load_scorms(args.parse_workers)
+			courses.append((other,other.attempts_for_user(other.userids_by_username[user.username])))
+			state.look_at_course(other)
+
+	return render_template('course/user.html',course=course,user=user,courses=courses,all_courses=all_courses)
+
 @app.route('/course/<course>/file/<path:path>')
 @with_course
 def course_file(course,path):
+	if isinstance(course.storage,ZipStorage):
+		try:
+			f = course.storage.open(path)
+		except KeyError:
+			abort(404)
+		return send_file(f,download_name=os.path.basename(path))
 	return send_from_directory(os.path.join(course.file_path),path)
 
-def start_time_chart(attempts,width=800,height=250):
-	get_start_time = lambda a: datetime(a.start_time.year,a.start_time.month,a.start_time.day)
-	attempts_by_date = sorted([a for a in attempts if a.start_time is not None],key=get_start_time)
-	attempts_by_day = {time:len(list(attempts)) for time,attempts in itertools.groupby(attempts_by_date,key=get_start_time)}
+def package_manifest(course):
+	with asset_lock:
+		if course.pk not in asset_cache:
+			asset_cache[course.pk] = course_manifest(course)
+		return asset_cache[course.pk]
 
-	aday = timedelta(days=1)
-	start = min(attempts_by_day.keys())
-	end = max(attempts_by_day.keys())
-	num_days = (end-start).days
-	days = [start+aday*i for i in range(num_days+1)]
-	data = [(day,attempts_by_day.get(day,0)) for day in days]
+# files served under a package's version can be cached for a year, since the version changes whenever any of them do
+asset_max_age = 365*24*60*60
+
+# A file from a SCORM package, under the package's current version.
+# The stored copy in the best encoding that the browser accepts is sent, and range requests are supported, for large media files.
+@app.route('/course/<course>/package/<scorm>/<version>/<path:path>')
+@with_course
+def package_file(course,scorm,version,path):
+	manifest = package_manifest(course)
+	current_version = manifest['packages'][scorm.pk]
+	if version!=current_version:
+		return redirect(url_for('package_file',course=course.pk,scorm=scorm.pk,version=current_version,path=path))
+	entry = manifest['files'].get('{}/{}'.format(scorm.pk,path))
+	if entry is None:
+		abort(404)
+
+	encoding = choose_encoding(entry,request.accept_encodings)
+	mimetype,_ = mimetypes.guess_type(path)
+	response = send_file(
+		os.path.abspath(asset_path(entry['digest'],encoding)),
+		mimetype=mimetype or 'application/octet-stream',
+		etag=entry['digest']+('-'+encoding if encoding else ''),
+		max_age=asset_max_age,
+	)
+	if encoding:
+		response.content_encoding = encoding
+	if entry['encodings']:
+		response.vary.add('Accept-Encoding')
+	response.cache_control.public = True
+	response.cache_control.immutable = True
+	return response
+
+# The XML of one of the content items in the course's hierarchy. Items are only read when they're looked at.
+# Other files in the archive, such as the user list and the SCORM packages' attempt data, can be huge, so they aren't shown, and neither are SCORM items.
+@app.route('/course/<course>/item/<ref>.xml')
+@with_course
+def course_item_xml(course,ref):
+	item = course.find_item(ref)
+	if item is None or item.scorm is not None:
+		abort(404)
+	return Response(course.item_xml(ref),mimetype='application/xml')
+
+def start_time_chart(statistics,width=800,height=250):
+	data = list(zip(statistics.start_days,statistics.start_counts))
 
 	chart = pygal.DateLine(width=width,height=height,show_legend=False)
 	chart.title = 'Start times of attempts'
@@ -122,28 +312,18 @@ def start_time_chart(attempts,width=800,height=250):
 
 	return chart
 
-def start_time_sparkline(attempts,width=800,height=250):
-	get_start_time = lambda a: datetime(a.start_time.year,a.start_time.month,a.start_time.day)
-	attempts_by_date = sorted([a for a in attempts if a.start_time is not None],key=get_start_time)
-	attempts_by_day = {time:len(list(attempts)) for time,attempts in itertools.groupby(attempts_by_date,key=get_start_time)}
-
-	aday = timedelta(days=1)
-	start = min(attempts_by_day.keys())
-	end = max(attempts_by_day.keys())
-	num_days = (end-start).days
-	data = [(i,attempts_by_day.get(start+aday*i,0)) for i in range(num_days+1)]
+def start_time_sparkline(statistics,width=800,height=250):
+	data = list(enumerate(statistics.start_counts))
 
 	chart = pygal.XY(width=width,height=height)
 	chart.add("",data)
 
 	return chart
 
-def score_chart(attempts,width=800,height=250):
-	score_bins = [len([a for a in attempts if a.scaled_score>=x/10 and a.scaled_score<(x+1)/10]) for x in range(10)]
-
+def score_chart(statistics,width=800,height=250):
 	chart = pygal.Bar(width=width,height=height,show_legend=False,human_readable=True)
 	chart.title = 'Score distribution'
-	chart.add('Number of attempts',score_bins)
+	chart.add('Number of attempts',statistics.score_histogram)
 	chart.x_labels = ['{}-{}%'.format(i,i+10) for i in range(0,100,10)]
 
 	return chart
@@ -151,67 +331,159 @@ def score_chart(attempts,width=800,height=250):
 @app.route('/course/<course>/scorm/<scorm>/start-times.svg')
 @with_course
 def start_time_chart_svg(course,scorm):
-	return start_time_chart(scorm.attempts).render_response()
+	return chart_response(course,scorm,'start-times',lambda width,height: start_time_chart(scorm.statistics,width,height).render())
 
 @app.route('/course/<course>/scorm/<scorm>/start-times-sparkline.svg')
 @with_course
 def start_time_sparkline_svg(course,scorm):
-	return Response(start_time_sparkline(scorm.attempts).render_sparkline().decode('utf-8'),mimetype='image/svg+xml')
+	return chart_response(course,scorm,'start-times-sparkline',lambda width,height: start_time_sparkline(scorm.statistics,width,height).render_sparkline())
 
 @app.route('/course/<course>/scorm/<scorm>/scores.svg')
 @with_course
 def score_chart_svg(course,scorm):
-	return score_chart(scorm.attempts).render_response()
+	return chart_response(course,scorm,'scores',lambda width,height: score_chart(scorm.statistics,width,height).render())
 
 @app.route('/course/<course>/scorm/<scorm>/score-sparkline.svg')
 @with_course
 def score_sparkline_svg(course,scorm):
-	chart = score_chart(scorm.attempts)
-	chart.title = ''
-	return Response(chart.render_sparkline().decode('utf-8'),mimetype='image/svg+xml')
+	def render(width,height):
+		chart = score_chart(scorm.statistics,width,height)
+		chart.title = ''
+		return chart.render_sparkline()
+	return chart_response(course,scorm,'score-sparkline',render)
+
+def item_analysis(course,scorm):
+	cache = analysis_cache.setdefault(course.pk,{})
+	if scorm.pk not in cache:
+		cache[scorm.pk] = ItemAnalysis(scorm)
+	return cache[scorm.pk]
+
+@app.route('/course/<course>/scorm/<scorm>/items')
+@with_course
+def item_analysis_page(course,scorm):
+	return render_template('scorm/items.html',course=course,scorm=scorm,analysis=item_analysis(course,scorm))
+
+@app.route('/course/<course>/scorm/<scorm>/items.json')
+@with_course
+def item_analysis_json(course,scorm):
+	etag = hashlib.sha1(repr((course.file_path,course.modified.timestamp(),scorm.pk,'items')).encode('utf-8')).hexdigest()
+	return conditional_response(etag,course.modified,'application/json',lambda: json.dumps(item_analysis(course,scorm).as_json()))
+
+default_page_size = 100
+max_page_size = 1000
 
 @app.route('/course/<course>/scorm/<scorm>/')
 @with_course
 def view_scorm(course,scorm):
 	sort = request.args.get('sort','name')
 	order = request.args.get('order','asc')
+	if sort not in attempt_sort_keys:
+		abort(400,'Unknown sort "{}"'.format(sort))
+	query = request.args.get('q','').strip()
+	page_size = min(max(request.args.get('page_size',default_page_size,type=int),1),max_page_size)
 
-	sorts = {
-		'name': lambda a: (a.user.last_name,a.user.first_name,a.start_time),
-		'username': lambda a: (a.user.username,a.start_time),
-		'score': lambda a: (a.scaled_score,a.user.last_name,a.user.first_name,a.number),
-		'starttime': lambda a: a.start_time or datetime.fromtimestamp(0),
-		'duration': lambda a: a.duration,
-		'attempt': lambda a: (a.number, a.user.last_name,a.user.first_name,a.start_time),
-	}
-	attempts = sorted(scorm.attempts,key=sorts[sort],reverse = order=='desc')
+	rows = scorm.sort_order(sort,order=='desc')
+	if query:
+		rows = rows[scorm.user_rows(query)[rows]]
+
+	num_pages = max(1,-(-len(rows)//page_size))
+	page = min(max(request.args.get('page',1,type=int),1),num_pages)
+	attempts = [scorm.attempts[row] for row in rows[(page-1)*page_size:page*page_size]]
+
+	# The URL of this page, with some of the parameters changed.
+	def page_url(**changes):
+		args = dict(sort=sort,order=order,q=query or None,page_size=page_size if page_size!=default_page_size else None,page=page)
+		args.update(changes)
+		return url_for('view_scorm',course=course.pk,scorm=scorm.pk,**args)
 
 	return render_template('scorm/index.html',
 			course=course,
 			scorm=scorm,
 			attempts=attempts,
+			num_matching=len(rows),
 			sort=sort,
 			order=order,
-			start_time_chart = start_time_chart(scorm.attempts).render().decode('utf-8'),
-			score_chart = score_chart(scorm.attempts).render().decode('utf-8')
+			query=query,
+			page=page,
+			num_pages=num_pages,
+			page_size=page_size,
+			page_url=page_url,
 		)
 
+# columns of the CSV export which have one value per attempt
+csv_columns = {
+	'name': ('Full Name', lambda a: a.user.fullname),
+	'username': ('Username', lambda a: a.user.username),
+	'start_time': ('Start time', lambda a: a.start_time),
+	'time_spent': ('Time spent', lambda a: a.total_time),
+	'raw_score': ('Raw Score', lambda a: a.raw_score),
+	'scaled_score': ('Scaled Score', lambda a: a.scaled_score*100),
+}
+# the 'objectives' group of columns has the score for each question, and the 'interactions' group has the response, result and correct response for each part
+csv_column_groups = ('objectives','interactions')
+csv_default_columns = ['name','username','start_time','time_spent','raw_score','scaled_score','objectives']
+csv_batch_size = 500
+
+# The CSV export is streamed out in batches of attempts, so it starts straight away and doesn't need to be held in memory.
 @app.route('/course/<course>/scorm/<scorm>.csv')
 @with_course
 def scorm_csv(course,scorm):
-	f = tempfile.TemporaryFile('w+',newline='')
-	w = csv.writer(f,lineterminator='\n')
-	w.writerow(['Full Name','Username','Start time','Time spent','Raw Score','Scaled Score']+['objective {}'.format(i) for i in scorm.objective_ids])
-	for attempt in scorm.attempts:
-		objective_scores = []
-		for objective_id in scorm.objective_ids:
-			if objective_id in attempt.objectives_by_id:
-				objective_scores.append(attempt.objectives_by_id[objective_id].raw_score)
-			else:
-				objective_scores.append('')
-		w.writerow([attempt.user.fullname,attempt.user.username,attempt.start_time,attempt.total_time,attempt.raw_score,attempt.scaled_score*100]+objective_scores)
-	f.seek(0)
-	return Response(f.read(),mimetype='text/csv')
+	names = request.args['columns'].split(',') if request.args.get('columns') else list(csv_default_columns)
+	if request.args.get('interactions') and 'interactions' not in names:
+		names.append('interactions')
+	for name in names:
+		if name not in csv_columns and name not in csv_column_groups:
+			abort(400,'Unknown column "{}"'.format(name))
+
+	store = scorm.store
+	objective_ids = scorm.objective_ids
+	# the interactions are only read if there are columns for them
+	interaction_ids = store.interaction_ids if 'interactions' in names else []
+
+	header = []
+	for name in names:
+		if name=='objectives':
+			header += ['objective {}'.format(i) for i in objective_ids]
+		elif name=='interactions':
+			for id in interaction_ids:
+				header += ['{} response'.format(id),'{} result'.format(id),'{} correct response'.format(id)]
+		else:
+			header.append(csv_columns[name][0])
+
+	def generate():
+		buffer = io.StringIO()
+		w = csv.writer(buffer,lineterminator='\n')
+		w.writerow(header)
+		# the header is sent straight away, and on its own when there are no attempts
+		yield buffer.getvalue()
+		buffer.seek(0)
+		buffer.truncate()
+		for start in range(0,len(scorm.attempts),csv_batch_size):
+			stop = min(start+csv_batch_size,len(scorm.attempts))
+			if 'objectives' in names:
+				objective_rows = store.objective_rows(objective_ids,start,stop)
+			if 'interactions' in names:
+				interaction_rows = store.interaction_rows(interaction_ids,start,stop)
+			for i,attempt in enumerate(scorm.attempts[start:stop]):
+				row = []
+				for name in names:
+					if name=='objectives':
+						row += [store.objectives.raw_score[j].item() if j>=0 else '' for j in objective_rows[i]]
+					elif name=='interactions':
+						for j in interaction_rows[i]:
+							if j>=0:
+								interaction = Interaction(attempt,j)
+								row += [interaction.learner_response,interaction.raw_score,interaction.correct_response]
+							else:
+								row += ['','','']
+					else:
+						row.append(csv_columns[name][1](attempt))
+				w.writerow(row)
+			yield buffer.getvalue()
+			buffer.seek(0)
+			buffer.truncate()
+
+	return Response(stream_with_context(generate()),mimetype='text/csv')
 
 @app.route('/course/<course>/scorm/<scorm>/attempt/<attempt>')
 @with_course
@@ -219,17 +491,12 @@ def attempt_report(course,scorm,attempt):
 	attempt = scorm.attempts_by_pk[attempt]
 	return render_template('scorm/report.html',course=course,scorm=scorm,attempt=attempt)
 
-@app.route('/course/<course>/scorm/<scorm>/attempt/<attempt>/review')
-@with_course
-def review(course,scorm,attempt):
-	attempt = scorm.attempts_by_pk[attempt]
-	
-	iframe = url_for('course_file',course=course.pk,path='{}/index.html'.format(scorm.pk))
-
+# The SCORM runtime data that an attempt is reviewed with.
+def attempt_cmi(attempt):
 	cmi = {
 		'cmi.mode': 'review',
 		'cmi.entry': 'resume',
-		'cmi.suspend_data': json.dumps(attempt.suspend_data),
+		'cmi.suspend_data': attempt.raw_suspend_data or 'null',
 		'cmi.objectives._count': len(attempt.objectives),
 		'cmi.interactions._count': len(attempt.interactions),
 		'cmi.learner_name': attempt.user.fullname,
@@ -269,22 +536,63 @@ def review(course,scorm,attempt):
 			'result': interaction.raw_score,
 			'description': interaction.part_type,
 		}
+		if interaction.objective:
+			d['objectives._count'] = 1
+			d['objectives.0.id'] = interaction.objective
+		else:
+			d['objectives._count'] = 0
+		if interaction.scorm_correct_response:
+			d['correct_responses._count'] = 1
+			d['correct_responses.0.pattern'] = interaction.scorm_correct_response
+		else:
+			d['correct_responses._count'] = 0
 		for k,v in d.items():
 			cmi['{}.{}'.format(p,k)] = v
 
-	if interaction.objective:
-		d['objectives._count'] = 1
-		d['objectives.1.id'] = interaction.objective
-	else:
-		d['objectives._count'] = 0
+	return cmi
 
-	if interaction.scorm_correct_response:
-		d['correct_responses._count'] = 1
-		d['correct_responses.1.pattern'] = interaction.scorm_correct_response
-	else:
-		d['correct_responses._count'] = 0
+# The attempt's runtime data as compact JSON. It's serialized once, and kept while the attempt is one of the most recently reviewed.
+def cmi_payload(course,scorm,attempt):
+	cache = cmi_cache.setdefault(course.pk,BoundedCache(cmi_cache_size))
+	return cache.get((scorm.pk,attempt.pk),lambda: json.dumps(attempt_cmi(attempt),separators=(',',':')))
 
-	return render_template('scorm/review.html',course=course,scorm=scorm,attempt=attempt,iframe=iframe,cmi=cmi)
+@app.route('/course/<course>/scorm/<scorm>/attempt/<attempt>/cmi.json')
+@with_course
+def attempt_cmi_json(course,scorm,attempt):
+	if attempt not in scorm.attempts_by_pk:
+		abort(404)
+	attempt = scorm.attempts_by_pk[attempt]
+	etag = hashlib.sha1(repr((course.file_path,course.modified.timestamp(),scorm.pk,attempt.pk,'cmi')).encode('utf-8')).hexdigest()
+	return conditional_response(etag,course.modified,'application/json',lambda: cmi_payload(course,scorm,attempt))
+
+# The attempts before and after this one in the package, which a marker stepping through them will look at next.
+def neighbouring_attempts(scorm,attempt):
+	attempts = scorm.attempts
+	return (attempts[attempt.row-1] if attempt.row>0 else None, attempts[attempt.row+1] if attempt.row+1<len(attempts) else None)
+
+# The attempt's runtime data is fetched by the page from attempt_cmi_json. With prefetch=1, the data for the previous and next attempts is fetched too, once this attempt's has loaded.
+@app.route('/course/<course>/scorm/<scorm>/attempt/<attempt>/review')
+@with_course
+def review(course,scorm,attempt):
+	attempt = scorm.attempts_by_pk[attempt]
+	prefetch = bool(request.args.get('prefetch'))
+
+	iframe = url_for('package_file',course=course.pk,scorm=scorm.pk,version=package_manifest(course)['packages'][scorm.pk],path='index.html')
+	cmi_url = url_for('attempt_cmi_json',course=course.pk,scorm=scorm.pk,attempt=attempt.pk)
+	previous_attempt,next_attempt = neighbouring_attempts(scorm,attempt)
+	prefetch_urls = [url_for('attempt_cmi_json',course=course.pk,scorm=scorm.pk,attempt=a.pk) for a in (next_attempt,previous_attempt) if a is not None] if prefetch else []
+
+	return render_template('scorm/review.html',
+			course=course,
+			scorm=scorm,
+			attempt=attempt,
+			iframe=iframe,
+			cmi_url=cmi_url,
+			prefetch=prefetch,
+			prefetch_urls=prefetch_urls,
+			previous_attempt=previous_attempt,
+			next_attempt=next_attempt,
+		)
 
 if __name__ == '__main__':
 	app.run(debug=True)
@@ -42,3 +42,19 @@ SCORM_API.prototype = {
 		this.data[element] = value;
 	}
 }
+
+// Fetch an attempt's runtime data from url, and call callback with an API for it.
+SCORM_API.load = function(url,callback) {
+	fetch(url,{credentials: 'same-origin'}).then(function(response) {
+		return response.json();
+	}).then(function(data) {
+		callback(new SCORM_API(data));
+	});
+}
+
+// Fetch other attempts' runtime data in the background, so the browser has it ready when they're reviewed.
+SCORM_API.prefetch = function(urls) {
+	urls.forEach(function(url) {
+		fetch(url,{credentials: 'same-origin'});
+	});
+}
@@ -0,0 +1,20 @@
+import json
+
+from benchmarks.synthetic import make_course
+
+# A package that nobody has attempted is exported as just the header row.
+def test_empty_package_has_header(tmp_path,monkeypatch):
+	path = make_course(str(tmp_path/'course'),num_scorms=1,num_users=0)
+	monkeypatch.chdir(tmp_path)
+	with open('state.json','w') as f:
+		json.dump({'courses':[{'path':path}]},f)
+
+	import server
+	course = server.state.courses[0]
+	scorm = course.scorms[0]
+	response = server.app.test_client().get('/course/{}/scorm/{}.csv'.format(course.pk,scorm.pk))
+	body = response.get_data(as_text=True)
+	response.close()
+
+	assert response.status_code==200
+	assert body.splitlines()==['Full Name,Username,Start time,Time spent,Raw Score,Scaled Score']
@@ -0,0 +1,64 @@
+import os
+import shutil
+import zipfile
+
+from benchmarks.synthetic import make_archive
+from blackboardscorm import State
+from ingestion import IngestionJob, IngestionQueue
+
+# Uploads are saved in the courses directory before they're ingested, as the server does.
+def ingest(queue,name,zip_path):
+	os.makedirs('courses',exist_ok=True)
+	upload_path = os.path.join('courses',name+'.upload')
+	shutil.copy(zip_path,upload_path)
+	job = IngestionJob(name,upload_path)
+	queue.run(job)
+	return job
+
+# An upload that can't be loaded leaves the version of the course that's being served as it was.
+def test_failed_upload_keeps_course(tmp_path,monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	make_archive(str(tmp_path/'course.zip'),num_scorms=2,num_users=5)
+	with zipfile.ZipFile(str(tmp_path/'broken.zip'),'w') as zip:
+		zip.writestr('imsmanifest.xml','not a manifest')
+
+	state = State()
+	queue = IngestionQueue(state,'courses',workers=1,parse_workers=1)
+	assert ingest(queue,'mycourse',str(tmp_path/'course.zip')).phase=='done'
+	course = state.courses[0]
+	files = os.listdir('courses')
+
+	assert ingest(queue,'mycourse',str(tmp_path/'broken.zip')).phase=='failed'
+	assert state.courses==[course]
+	assert os.listdir('courses')==files
+	assert len(State().courses[0].scorms)==2
+
+# Uploading a course again replaces the old version, which is removed.
+def test_upload_replaces_old_version(tmp_path,monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	make_archive(str(tmp_path/'course.zip'),num_scorms=2,num_users=5)
+
+	state = State()
+	queue = IngestionQueue(state,'courses',workers=1,parse_workers=1)
+	ingest(queue,'mycourse',str(tmp_path/'course.zip'))
+	old_path = state.courses[0].file_path
+	ingest(queue,'mycourse',str(tmp_path/'course.zip'))
+	new_path = state.courses[0].file_path
+
+	assert new_path!=old_path
+	assert os.listdir('courses')==[os.path.basename(new_path)]
+	assert State().courses[0].file_path==new_path
+
+# The sizes of the upload and of the packages that were loaded are still reported once the job has finished.
+def test_finished_job_reports_bytes(tmp_path,monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	make_archive(str(tmp_path/'course.zip'),num_scorms=2,num_users=5)
+
+	state = State()
+	queue = IngestionQueue(state,'courses',workers=1,parse_workers=1)
+	status = ingest(queue,'mycourse',str(tmp_path/'course.zip')).status()
+
+	assert status['phase']=='done'
+	assert status['upload_bytes']==os.path.getsize(str(tmp_path/'course.zip'))
+	assert status['load_bytes_total']==status['load_bytes_done']==sum(scorm.size for scorm in state.courses[0].scorms)
+	assert status['load_bytes_total']>0
@@ -0,0 +1,47 @@
+import json
+import threading
+
+from benchmarks.synthetic import make_course
+from blackboardscorm import State
+
+# A course that's being loaded can't be unloaded until the load has finished, but requests for other courses don't wait for that.
+def test_evicting_busy_course_does_not_block_state(tmp_path,monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	paths = [make_course(str(tmp_path/name),title=name,num_scorms=1,num_users=5) for name in ('one','two')]
+	with open('state.json','w') as f:
+		json.dump({'courses':[{'path':path} for path in paths]},f)
+
+	state = State(memory_budget=1)
+	one,two = state.courses
+	state.use_course(one.pk).load_scorms(1)
+
+	with one.lock:
+		user = threading.Thread(target=lambda: state.use_course(two.pk).load_scorms(1))
+		user.start()
+		user.join(0.5)
+		assert state.lock.acquire(timeout=1)
+		state.lock.release()
+	user.join()
+
+	assert list(state.loaded_courses)==[two.pk]
+	assert not any(scorm.loaded for scorm in one.scorms)
+
+# Finding a user's attempts in every course doesn't count as using the other courses, so the course that was being used stays loaded.
+def test_looking_at_course_keeps_recently_used(tmp_path,monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	paths = [make_course(str(tmp_path/name),title=name,num_scorms=1,num_users=5) for name in ('one','two')]
+	with open('state.json','w') as f:
+		json.dump({'courses':[{'path':path} for path in paths]},f)
+
+	state = State(memory_budget=1)
+	one,two = state.courses
+	state.use_course(one.pk).load_scorms(1)
+
+	assert state.courses_for_username('user0')==[one,two]
+	assert state.courses_for_username('nobody')==[]
+	two.load_scorms(1)
+	assert two.attempts_for_user(two.userids_by_username['user0'])
+	state.look_at_course(two)
+
+	assert list(state.loaded_courses)==[one.pk]
+	assert all(scorm.loaded for scorm in one.scorms)
@@ -0,0 +1,16 @@
+# Entry point for running the server under a WSGI server with several worker processes, for example:
+#
+#     gunicorn --workers 4 wsgi:app
+#
+# Each course's attempts are parsed once into a snapshot in the snapshots directory, which every worker memory-maps.
+# When a course is uploaded, the worker that ingests it publishes a new snapshot and updates state.json, and the other workers pick it up on their next request.
+#
+# The server's other options can be given in the SCORM_ANALYSIS_OPTIONS environment variable, for example
+#
+#     SCORM_ANALYSIS_OPTIONS="--memory-budget 4096" gunicorn --workers 4 wsgi:app
+
+import os
+
+os.environ['SCORM_ANALYSIS_OPTIONS'] = '--snapshots '+os.environ.get('SCORM_ANALYSIS_OPTIONS','')
+
+from server import app